@@ -1,4 +1,7 @@
 import random
+import time
+
+import ChessEngine
 
 chessPieceValuesDictionary = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'p': 1} # Dictionary of the points for each piece
 
@@ -68,18 +71,294 @@ blackPawnPositionScores = [
     [8, 8, 8, 8, 8, 8, 8, 8]
 ]  # Higher score squares are at the bottom of the board
 
+# In the endgame pawns are worth more the closer they are to promoting
+whitePawnEndgameScores = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [10, 10, 10, 10, 10, 10, 10, 10],
+    [8, 8, 8, 8, 8, 8, 8, 8],
+    [6, 6, 6, 6, 6, 6, 6, 6],
+    [4, 4, 4, 4, 4, 4, 4, 4],
+    [2, 2, 2, 2, 2, 2, 2, 2],
+    [1, 1, 1, 1, 1, 1, 1, 1],
+    [0, 0, 0, 0, 0, 0, 0, 0]
+]
+
+blackPawnEndgameScores = whitePawnEndgameScores[::-1]
+
+whiteKingMiddlegameScores = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [1, 0, 0, 0, 0, 0, 0, 1],
+    [2, 2, 1, 0, 0, 1, 2, 2],
+    [3, 4, 2, 0, 0, 1, 4, 3]
+]  # The king is safest tucked away behind its pawns in the corner
+
+blackKingMiddlegameScores = whiteKingMiddlegameScores[::-1]
+
+kingEndgameScores = [
+    [0, 1, 1, 1, 1, 1, 1, 0],
+    [1, 2, 2, 2, 2, 2, 2, 1],
+    [1, 2, 3, 3, 3, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 3, 3, 3, 2, 1],
+    [1, 2, 2, 2, 2, 2, 2, 1],
+    [0, 1, 1, 1, 1, 1, 1, 0]
+]  # With the queens gone the king should come to the centre and join in
+
 piecePositionalScores = {
     "N": knightPositionalScores,
     "Q": queenPositionalScores,
     "R": rookPositionalScores,
     "B": bishopPositionalScores,
     "bp": blackPawnPositionScores,
-    "wp": whitePawnPositionScores
-}
+    "wp": whitePawnPositionScores,
+    "bK": blackKingMiddlegameScores,
+    "wK": whiteKingMiddlegameScores
+}  # Middlegame scores, and the scores of the pieces that are the same in both phases
+
+piecePositionalEndgameScores = {
+    "bp": blackPawnEndgameScores,
+    "wp": whitePawnEndgameScores,
+    "bK": kingEndgameScores,
+    "wK": kingEndgameScores
+}  # Only the pieces that should play differently in the endgame
 
 checkmateScore = 100000
 stalemateScore = 0
-aiSearchDepth = 3
+drawScore = 0  # Repetitions and the 50 move rule
+limitCheckInterval = 256  # The clock is only looked at every this many nodes
+timeSearchPhases = False  # Times move generation, make/unmake and evaluation in the stats, ChessProfiler switches it on
+evalCacheSize = 1 << 16  # Entries in the evaluation table, a power of 2
+pawnCacheSize = 1 << 12  # Entries in the pawn structure table, a power of 2
+transpositionTableSize = 1 << 18  # Entries in the transposition table, a power of 2
+# What the score in a transposition table entry means - searches that were cut off only give a bound
+exactScore = 0
+lowerBound = 1  # The score was at least beta, a move was good enough to stop searching
+upperBound = 2  # No move got above alpha, so the real score is this or lower
+doubledPawnPenalty = 1  # For every pawn on a file after the first
+isolatedPawnPenalty = 1  # For a pawn with no friendly pawns on the files next to it
+passedPawnBonuses = [0, 1, 1, 2, 3, 5, 8, 0]  # By how many rows a passed pawn has moved up the board
+searchStats = None  # The SearchStats record of the search currently running
+rootScores = {}  # moveId -> score of each root move searched so far. Only the best one is exact, the rest are upper bounds
+lastSearchStats = None  # The SearchStats record of the most recent finished search
+
+
+
+'''
+A fixed size table of values by hash key. The slot is picked by the low bits of the key and a new value
+always replaces the old one, so looking up and storing are both a single list access
+'''
+class HashTable:
+    def __init__(self, size):
+        self.mask = size - 1
+        self.keys = [None] * size
+        self.values = [None] * size
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, hash_key):
+        self.probes += 1
+        index = hash_key & self.mask
+        if self.keys[index] != hash_key:
+            return None
+        self.hits += 1
+        return self.values[index]
+
+    def put(self, hash_key, value):
+        index = hash_key & self.mask
+        self.keys[index] = hash_key
+        self.values[index] = value
+
+    def clear(self):
+        for index in range(len(self.keys)):
+            self.keys[index] = None
+            self.values[index] = None
+
+    def hit_rate(self):
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+
+# Shared by every search - the Zobrist numbers are the same for every game so old entries stay correct
+evalCache = HashTable(evalCacheSize)  # Position hash -> evaluate_board score
+pawnCache = HashTable(pawnCacheSize)  # Pawn hash -> pawn structure score
+transpositionTable = HashTable(transpositionTableSize)  # Position hash -> (depth, score, flag, best move)
+
+
+'''
+How strongly the AI plays and how much it can spend on a move. The search deepens one ply at a time up to depth,
+and stops early once it has visited node_limit positions or run for time_limit seconds (None for no limit).
+With multi_pv above 1 the best multi_pv moves are found and one of the ones scoring within random_margin
+of the best is picked at random, which makes the AI weaker and less predictable
+'''
+class EngineProfile:
+    def __init__(self, name, depth, node_limit=None, time_limit=None, multi_pv=1, random_margin=0):
+        self.name = name
+        self.depth = depth
+        self.nodeLimit = node_limit
+        self.timeLimit = time_limit
+        self.multiPV = multi_pv
+        self.randomMargin = random_margin
+
+    '''
+    Returns a copy with the time limit lowered to time_limit if that is less, e.g. for a server's own time limit
+    '''
+    def with_time_limit(self, time_limit):
+        if self.timeLimit is not None and self.timeLimit <= time_limit:
+            return self
+        return EngineProfile(self.name, self.depth, self.nodeLimit, time_limit, self.multiPV, self.randomMargin)
+
+
+engineProfiles = {
+    'beginner': EngineProfile('beginner', 1, multi_pv=4, random_margin=3),
+    'casual': EngineProfile('casual', 2, multi_pv=3, random_margin=1.5),
+    'club': EngineProfile('club', 3),
+    'strong': EngineProfile('strong', 4, time_limit=10.0),
+    'server': EngineProfile('server', 4, node_limit=20000, time_limit=5.0)  # A fixed amount of work per move
+}
+defaultProfile = engineProfiles['club']
+
+
+class SearchAborted(Exception):
+    pass
+
+
+'''
+Keeps track of everything the search did so that we can see how efficient it was.
+One record is made per call to get_best_move
+'''
+class SearchStats:
+    def __init__(self, depth, node_limit=None, time_limit=None, profile_name=None):
+        self.depth = depth
+        self.profileName = profile_name
+        self.iterationDepth = depth  # The depth of the iteration of iterative deepening that is running
+        self.completedDepth = 0  # The deepest iteration that finished
+        self.nodeLimit = node_limit
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.aborted = False  # Whether a limit stopped the search early
+        self.rootMovesRestricted = False  # Only some of the root's moves are being searched, e.g. by MultiPV
+        self.bestMove = None
+        self.bestScore = None  # None if the search was stopped before it finished the first ply
+        self.nodes = 0  # Every position visited by negamax_search
+        self.quiescenceNodes = 0  # Positions visited by the quiescence search only
+        self.nodesPerDepth = [0] * (depth + 1)  # Index 0 is the root, index depth is the leaves
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0  # Cutoffs caused by the first move searched (a measure of move ordering)
+        self.pathDraws = 0  # Repetition and 50 move rule draws, which depend on the moves that led to the position
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.evalCacheProbes = 0
+        self.evalCacheHits = 0
+        self.pawnCacheProbes = 0
+        self.pawnCacheHits = 0
+        self.phasesTimed = timeSearchPhases  # Otherwise the three times below stay 0 and are written as null
+        self.moveGenerationTime = 0.0
+        self.makeUnmakeTime = 0.0
+        self.evaluationTime = 0.0
+        self.startTime = time.perf_counter()
+        self.elapsedTime = 0.0
+        # The tables are shared between searches, so this search's share of their counts is worked out in finish
+        self.cacheCountsAtStart = (evalCache.probes, evalCache.hits, pawnCache.probes, pawnCache.hits)
+
+    '''
+    Called at every node, raises SearchAborted once a limit has been reached
+    '''
+    def check_limits(self):
+        visited = self.nodes + self.quiescenceNodes
+        if self.nodeLimit is not None and visited >= self.nodeLimit:
+            raise SearchAborted()
+        if self.deadline is not None and visited % limitCheckInterval == 0 and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def finish(self):
+        self.elapsedTime = time.perf_counter() - self.startTime
+        eval_probes, eval_hits, pawn_probes, pawn_hits = self.cacheCountsAtStart
+        self.evalCacheProbes = evalCache.probes - eval_probes
+        self.evalCacheHits = evalCache.hits - eval_hits
+        self.pawnCacheProbes = pawnCache.probes - pawn_probes
+        self.pawnCacheHits = pawnCache.hits - pawn_hits
+
+    def nodes_per_second(self):
+        if self.elapsedTime == 0:
+            return 0.0
+        return (self.nodes + self.quiescenceNodes) / self.elapsedTime
+
+    def first_move_cutoff_percentage(self):
+        if self.betaCutoffs == 0:
+            return 0.0
+        return 100 * self.firstMoveCutoffs / self.betaCutoffs
+
+    def tt_hit_rate(self):
+        if self.ttProbes == 0:
+            return 0.0
+        return self.ttHits / self.ttProbes
+
+    def eval_cache_hit_rate(self):
+        if self.evalCacheProbes == 0:
+            return 0.0
+        return self.evalCacheHits / self.evalCacheProbes
+
+    def pawn_cache_hit_rate(self):
+        if self.pawnCacheProbes == 0:
+            return 0.0
+        return self.pawnCacheHits / self.pawnCacheProbes
+
+    def branching_factors(self):
+        # Effective branching factor of each depth is the number of nodes at that depth divided by the depth above
+        factors = []
+        for d in range(1, len(self.nodesPerDepth)):
+            if self.nodesPerDepth[d - 1] == 0:
+                factors.append(0.0)
+            else:
+                factors.append(self.nodesPerDepth[d] / self.nodesPerDepth[d - 1])
+        return factors
+
+    def to_dict(self):
+        return {
+            'depth': self.depth,
+            'profile': self.profileName,
+            'completedDepth': self.completedDepth,
+            'aborted': self.aborted,
+            'bestMove': None if self.bestMove is None else self.bestMove.get_move_in_chess_notation(),
+            'bestScore': self.bestScore,
+            'nodes': self.nodes,
+            'quiescenceNodes': self.quiescenceNodes,
+            'nodesPerSecond': round(self.nodes_per_second(), 1),
+            'betaCutoffs': self.betaCutoffs,
+            'firstMoveCutoffPercentage': round(self.first_move_cutoff_percentage(), 2),
+            'nodesPerDepth': self.nodesPerDepth,
+            'branchingFactors': [round(factor, 3) for factor in self.branching_factors()],
+            'ttProbes': self.ttProbes,
+            'ttHits': self.ttHits,
+            'ttHitRate': round(self.tt_hit_rate(), 4),
+            'evalCacheHitRate': round(self.eval_cache_hit_rate(), 4),
+            'pawnCacheHitRate': round(self.pawn_cache_hit_rate(), 4),
+            'moveGenerationTime': round(self.moveGenerationTime, 6) if self.phasesTimed else None,
+            'makeUnmakeTime': round(self.makeUnmakeTime, 6) if self.phasesTimed else None,
+            'evaluationTime': round(self.evaluationTime, 6) if self.phasesTimed else None,
+            'elapsedTime': round(self.elapsedTime, 6)
+        }
+
+    def to_json_line(self):
+        import json  # Only imported when stats are written so that importing the AI stays fast
+        return json.dumps(self.to_dict()) + '\n'
+
+
+'''
+Returns a stats callback that writes each search as one JSON line to the given file
+'''
+def json_lines_writer(file):
+    def write_stats(stats):
+        file.write(stats.to_json_line())
+        file.flush()
+    return write_stats
+
+
 '''
 Picks and returns a random move
 '''
@@ -90,39 +369,327 @@ def choose_random_move(valid_moves):
 
 
 '''
-Method to make the first recursive call
+Method to make the first recursive call. profile is an EngineProfile or the name of one in engineProfiles
 '''
 
-def get_best_move(gs, valid_moves):  # Helper method to call the initial recursive call and return the result at the end
-    global next_move_1
-    next_move_1 = None
+def get_best_move(gs, valid_moves, stats_callback=None, profile=None):  # Helper method to call the initial recursive call and return the result at the end
+    return search_position(gs, valid_moves, stats_callback, profile).bestMove
+
+def get_profile(profile):
+    if profile is None:
+        return defaultProfile
+    if isinstance(profile, str):
+        return engineProfiles[profile]
+    return profile
+
+def start_search(profile):
+    global searchStats
+    searchStats = SearchStats(profile.depth, profile.nodeLimit, profile.timeLimit, profile.name)
+
+def finish_search(stats_callback):
+    global searchStats, lastSearchStats
+    stats = searchStats
+    stats.finish()
+    searchStats = None
+    lastSearchStats = stats
+    if stats_callback is not None:
+        stats_callback(stats)
+    return stats
+
+'''
+Runs a full search and returns its SearchStats record, which also holds the best move and its score
+'''
+def search_position(gs, valid_moves, stats_callback=None, profile=None):
+    profile = get_profile(profile)
+    if profile.multiPV > 1:
+        lines = analyse_position(gs, valid_moves, profile.multiPV, None, profile)
+        stats = lastSearchStats
+        if len(lines) != 0:
+            # A weaker profile plays any of the lines that are nearly as good as the best one
+            choices = [line for line in lines if line.score >= lines[0].score - profile.randomMargin]
+            line = random.choice(choices)
+            stats.bestMove = line.move
+            stats.bestScore = line.score
+        if stats_callback is not None:
+            stats_callback(stats)
+        return stats
+
+    start_search(profile)
     random.shuffle(valid_moves)
-    negamax_search(gs, valid_moves, aiSearchDepth, -checkmateScore, checkmateScore, 1 if gs.whiteToMove else -1)
-    return next_move_1
+    move, score = search_root(gs, valid_moves)
+    searchStats.bestMove = move
+    searchStats.bestScore = score
+    return finish_search(stats_callback)
+
+'''
+One line of a MultiPV analysis. The score is from the point of view of the player to move
+'''
+class AnalysisLine:
+    def __init__(self, move, score, principal_variation):
+        self.move = move
+        self.score = score
+        self.principalVariation = principal_variation  # The moves both players are expected to play, starting with move
+
+    def to_dict(self):
+        return {
+            'move': self.move.get_move_in_chess_notation(),
+            'score': self.score,
+            'pv': [move.get_move_in_chess_notation() for move in self.principalVariation]
+        }
+
+
+'''
+MultiPV analysis - finds the best number_of_lines moves with their scores and principal variations, best first.
+Each pass searches the root again without the moves already found. The transposition table is shared between
+the passes, so the later passes mostly find the positions they need already searched
+'''
+def analyse_position(gs, valid_moves, number_of_lines=3, stats_callback=None, profile=None):
+    profile = get_profile(profile)
+    start_search(profile)
+    remaining_moves = list(valid_moves)
+    random.shuffle(remaining_moves)
+    lines = []
+    beta = checkmateScore
+    while len(lines) < number_of_lines and len(remaining_moves) != 0 and not searchStats.aborted:
+        move, score = search_root(gs, remaining_moves, beta, len(lines) != 0)
+        if score is None:  # Stopped by a limit before the first iteration finished, so the move has no score
+            if len(lines) == 0:
+                searchStats.bestMove = move  # Better than nothing for playing, but not a line
+            break
+        lines.append(AnalysisLine(move, score, get_principal_variation(gs, move, profile.depth)))
+        remaining_moves.remove(move)
+        # The next pass is searched in the order this one scored the moves, and none of them can score better than
+        # this move did, so that can be the upper end of the window
+        remaining_moves.sort(key=lambda remaining_move: rootScores.get(remaining_move.moveId, -checkmateScore),
+                             reverse=True)
+        beta = score + 1
+    if len(lines) != 0:
+        searchStats.bestMove = lines[0].move
+        searchStats.bestScore = lines[0].score
+    finish_search(stats_callback)
+    return lines
+
+'''
+Searches the moves from the root one ply deeper each time (iterative deepening) and returns the best move and its
+score. The transposition table makes each iteration try the best moves of the last one first, and when a limit
+stops an iteration part way the move from the last finished iteration is used. beta only applies to the last
+iteration because a shallower search can score a move higher. If not even the first iteration finished, the score
+is None because the move hasn't really been scored. With moves_restricted, valid_moves is only some of
+the root's moves (the later passes of MultiPV), so the root's score isn't saved in the transposition table
+'''
+def search_root(gs, valid_moves, beta=checkmateScore, moves_restricted=False):
+    global next_move
+    stats = searchStats
+    stats.rootMovesRestricted = moves_restricted
+    best_move = None
+    best_score = None
+    moves_before_search = len(gs.moveLog)
+    for depth in range(1, stats.depth + 1):
+        next_move = None
+        rootScores.clear()
+        stats.iterationDepth = depth
+        try:
+            score = negamax_search(gs, valid_moves, depth, -checkmateScore, beta if depth == stats.depth else checkmateScore,
+                                   1 if gs.whiteToMove else -1)
+        except SearchAborted:
+            while len(gs.moveLog) > moves_before_search:  # Takes back the moves the search was in the middle of
+                gs.undo_move()
+            gs.get_valid_moves()  # Puts the checks and pins of the root position back
+            stats.aborted = True
+            if best_move is None:
+                best_move = next_move  # Better than nothing if the first iteration didn't finish
+            break
+        best_move = next_move
+        best_score = score
+        stats.completedDepth = depth
+    return best_move, best_score
+
+'''
+Follows the best moves saved in the transposition table from the position after the move
+'''
+def get_principal_variation(gs, move, length):
+    principal_variation = [move]
+    gs.make_move(move)
+    while len(principal_variation) < length:
+        entry = transpositionTable.get(gs.hashKey)
+        if entry is None or entry[3] is None or entry[3] not in gs.get_valid_moves():
+            break  # Not searched, or overwritten by a different position
+        principal_variation.append(entry[3])
+        gs.make_move(entry[3])
+    for i in range(len(principal_variation)):
+        gs.undo_move()
+    return principal_variation
 
 def negamax_search(gs, valid_moves, depth, alpha, beta, turn_multiplier):  # Alpha is the upper bound, Beta is the lower bound*
-    global next_move  # Fixed global variable to match the correct variable name
+    global next_move
+    stats = searchStats
+    stats.check_limits()
+    stats.nodes += 1
+    stats.nodesPerDepth[stats.iterationDepth - depth] += 1
+    is_root = depth == stats.iterationDepth
+    if not is_root and (gs.halfmoveClock >= 100 or gs.repetition_count(1) >= 1):
+        # A position repeated inside the search is treated as a draw straight away, there is no point searching it again
+        stats.pathDraws += 1
+        return drawScore
     if depth == 0:
-        return turn_multiplier * evaluate_board(gs)
-    # Ordering the moves will implement later
+        return quiescence_search(gs, valid_moves, alpha, beta, turn_multiplier)
+    if len(valid_moves) == 0:
+        return -checkmateScore if gs.checkmate else stalemateScore
+
+    # The root is never answered from the table because it has to choose next_move from the moves it was given
+    stats.ttProbes += 1
+    entry = transpositionTable.get(gs.hashKey)
+    hash_move = None
+    if entry is not None:
+        stats.ttHits += 1
+        entry_depth, entry_score, entry_flag, hash_move = entry
+        if entry_depth >= depth and not is_root:
+            if entry_flag == exactScore:
+                return entry_score
+            elif entry_flag == lowerBound:
+                alpha = max(alpha, entry_score)
+            else:
+                beta = min(beta, entry_score)
+            if alpha >= beta:
+                return entry_score
+
+    ordered_moves = order_moves(gs, valid_moves)
+    if hash_move is not None and hash_move in ordered_moves:
+        ordered_moves.remove(hash_move)  # The best move last time is tried first
+        ordered_moves.insert(0, hash_move)
+
+    original_alpha = alpha
+    path_draws_before = stats.pathDraws
     max_score = -checkmateScore
-    for move in valid_moves:
-        gs.make_move(move)
-        next_moves = gs.get_valid_moves()
+    best_move = None
+    for move_number, move in enumerate(ordered_moves):
+        if timeSearchPhases:
+            next_moves = make_move_timed(gs, move, stats)
+        else:
+            gs.make_move(move)
+            next_moves = gs.get_valid_moves()
+
         score = -negamax_search(gs, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)  # the minimum and maximum get reversed for the opponent
-        if score > max_score:
+        if is_root:
+            rootScores[move.moveId] = score
+        if score > max_score or best_move is None:
             max_score = score
+            best_move = move
+            if is_root:
+                next_move = move  # Only the root remembers the best move found so far
 
-        if depth == aiSearchDepth:
-            next_move = move  # Fixed global variable to match the correct variable name
-        gs.undo_move()
+        if timeSearchPhases:
+            undo_move_timed(gs, stats)
+        else:
+            gs.undo_move()
 
         if max_score > alpha:  # Pruning happens here
             alpha = max_score
         if alpha >= beta:  # We don't need to look anymore
+            stats.betaCutoffs += 1
+            if move_number == 0:
+                stats.firstMoveCutoffs += 1
+            break
+
+    if max_score <= original_alpha:
+        flag = upperBound
+    elif max_score >= beta:
+        flag = lowerBound
+    else:
+        flag = exactScore
+    # Not stored if the score is only the score of some of the moves, or if a draw below depended on the moves that
+    # got here - the table is shared by every game, and another path to this position may not be a draw
+    if not (is_root and stats.rootMovesRestricted) and stats.pathDraws == path_draws_before:
+        transpositionTable.put(gs.hashKey, (depth, max_score, flag, best_move))
+    return max_score
+
+'''
+The timed versions of making a move (with generating the next moves) and taking it back, only used with
+timeSearchPhases so that the search doesn't pay for the clock otherwise
+'''
+def make_move_timed(gs, move, stats):
+    start = time.perf_counter()
+    gs.make_move(move)
+    stats.makeUnmakeTime += time.perf_counter() - start
+    start = time.perf_counter()
+    next_moves = gs.get_valid_moves()
+    stats.moveGenerationTime += time.perf_counter() - start
+    return next_moves
+
+def undo_move_timed(gs, stats):
+    start = time.perf_counter()
+    gs.undo_move()
+    stats.makeUnmakeTime += time.perf_counter() - start
+
+'''
+Carries on searching captures past the end of the search so that the score isn't taken in the middle of an exchange.
+The player to move can always stop capturing, so the static evaluation is the least they can get (stand pat).
+Captures that lose material by static exchange evaluation are never searched
+'''
+def quiescence_search(gs, valid_moves, alpha, beta, turn_multiplier):
+    stats = searchStats
+    stats.check_limits()
+    stats.quiescenceNodes += 1
+    if timeSearchPhases:
+        start = time.perf_counter()
+        stand_pat = turn_multiplier * evaluate_board(gs)
+        stats.evaluationTime += time.perf_counter() - start
+    else:
+        stand_pat = turn_multiplier * evaluate_board(gs)
+    if stand_pat >= beta or gs.checkmate or gs.stalemate:
+        return stand_pat
+    if stand_pat > alpha:
+        alpha = stand_pat
+
+    max_score = stand_pat
+    for move_number, move in enumerate(order_moves(gs, valid_moves, captures_only=True)):
+        if timeSearchPhases:
+            next_moves = make_move_timed(gs, move, stats)
+        else:
+            gs.make_move(move)
+            next_moves = gs.get_valid_moves()
+
+        score = -quiescence_search(gs, next_moves, -beta, -alpha, -turn_multiplier)
+
+        if timeSearchPhases:
+            undo_move_timed(gs, stats)
+        else:
+            gs.undo_move()
+
+        if score > max_score:
+            max_score = score
+        if max_score > alpha:
+            alpha = max_score
+        if alpha >= beta:
+            stats.betaCutoffs += 1
+            if move_number == 0:
+                stats.firstMoveCutoffs += 1
             break
     return max_score
 
+'''
+Puts the captures that win material first, best first, then the equal captures, the quiet moves and the
+captures that lose material last, using the static exchange evaluation.
+With captures_only only the captures (and promotions) that don't lose material are returned
+'''
+def order_moves(gs, moves, captures_only=False):
+    captures = []
+    quiet_moves = []
+    losing_captures = []
+    for move in moves:
+        if move.pieceCaptured == '--' and not move.isPawnPromotion:
+            if not captures_only:
+                quiet_moves.append(move)
+            continue
+        exchange = gs.static_exchange_evaluation(move)
+        if exchange >= 0:
+            captures.append((exchange, move))
+        elif not captures_only:
+            losing_captures.append((exchange, move))
+    captures.sort(key=lambda capture: capture[0], reverse=True)  # sort is stable so shuffled moves stay shuffled
+    losing_captures.sort(key=lambda capture: capture[0], reverse=True)
+    return [move for exchange, move in captures] + quiet_moves + [move for exchange, move in losing_captures]
+
 '''
 Positive score is good for white --> negative score is good for black
 '''
@@ -135,23 +702,69 @@ def evaluate_board(gs):
     elif gs.stalemate:
         return stalemateScore
 
-    score = 0
+    score = evalCache.get(gs.hashKey)
+    if score is not None:
+        return score
+
+    score = pawn_structure_score(gs)
+    middlegame = 0  # Scores of the pieces in piecePositionalEndgameScores, blended by the phase at the end
+    endgame = 0
     for row in range(len(gs.board)):
         for col in range(len(gs.board[row])):
             # Score will be positive if white is winning, negative if black is winning
             square = gs.board[row][col]
             if square != '--':
                 # I will score the board positionally
-                piece_position_score = 0
-                if square[1] != 'K':
-                    if square[1] == 'p':  # for pawns
-                        piece_position_score = piecePositionalScores[square][row][col]
-                    else:  # for other pieces
-                        piece_position_score = piecePositionalScores[square[1]][row][col]  # Gets the correct score of the pieces in the correct position
-                if square[0] == 'w':
-                    score += chessPieceValuesDictionary[square[1]] + piece_position_score
-                elif square[0] == 'b':
-                    score -= chessPieceValuesDictionary[square[1]] + piece_position_score
+                sign = 1 if square[0] == 'w' else -1
+                score += sign * chessPieceValuesDictionary[square[1]]
+                if square in piecePositionalEndgameScores:  # pawns and kings
+                    middlegame += sign * piecePositionalScores[square][row][col]
+                    endgame += sign * piecePositionalEndgameScores[square][row][col]
+                else:  # for other pieces
+                    score += sign * piecePositionalScores[square[1]][row][col]  # Gets the correct score of the pieces in the correct position
 
+    # Tapered evaluation - all middlegame at the start, moving over to all endgame as the pieces come off
+    phase = min(gs.phase, ChessEngine.maxPhase)  # Promotions can take it above the maximum
+    score += (middlegame * phase + endgame * (ChessEngine.maxPhase - phase)) / ChessEngine.maxPhase
+
+    evalCache.put(gs.hashKey, score)
     return score
 
+'''
+Doubled, isolated and passed pawns, positive is good for white. Only depends on where the pawns are,
+so it is looked up in the pawn table by the pawn hash and only worked out when the pawns have changed
+'''
+def pawn_structure_score(gs):
+    score = pawnCache.get(gs.pawnHashKey)
+    if score is not None:
+        return score
+
+    white_pawns = [[] for col in range(8)]  # The rows of the pawns on each file
+    black_pawns = [[] for col in range(8)]
+    for row in range(1, 7):  # Pawns can't be on the first or last row
+        for col in range(8):
+            if gs.board[row][col] == 'wp':
+                white_pawns[col].append(row)
+            elif gs.board[row][col] == 'bp':
+                black_pawns[col].append(row)
+
+    score = 0
+    for col in range(8):
+        neighbours = range(max(col - 1, 0), min(col + 2, 8))
+        if len(white_pawns[col]) > 1:
+            score -= doubledPawnPenalty * (len(white_pawns[col]) - 1)
+        if len(black_pawns[col]) > 1:
+            score += doubledPawnPenalty * (len(black_pawns[col]) - 1)
+        for row in white_pawns[col]:
+            if all(len(white_pawns[c]) == 0 for c in neighbours if c != col):
+                score -= isolatedPawnPenalty
+            if all(black_row > row for c in neighbours for black_row in black_pawns[c]):
+                score += passedPawnBonuses[6 - row]  # No black pawn in front of it or on the files next to it
+        for row in black_pawns[col]:
+            if all(len(black_pawns[c]) == 0 for c in neighbours if c != col):
+                score += isolatedPawnPenalty
+            if all(white_row < row for c in neighbours for white_row in white_pawns[c]):
+                score -= passedPawnBonuses[row - 1]
+
+    pawnCache.put(gs.pawnHashKey, score)
+    return score
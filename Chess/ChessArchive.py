@@ -0,0 +1,167 @@
+"""
+This file reads and writes the binary game archive. A game takes a small header and two bytes per move,
+instead of a list of Move objects or PGN text, and any game can be found straight away from the index.
+
+    file header     magic b'NEAGAMES', uint32 version
+    each game       uint8 result, uint8 reserved, uint16 FEN length, uint32 number of moves,
+                    the FEN of the start position (ASCII, left out for the normal start),
+                    one uint16 per move (Move.get_move_code)
+    index           one uint64 file offset per game
+    footer          uint64 offset of the index, uint64 number of games, magic b'NEAINDEX'
+
+All numbers are little-endian. The index is written when the writer is closed, so games can be added
+one at a time without knowing how many there will be.
+"""
+import mmap
+import struct
+import sys
+from array import array
+
+import ChessEngine
+
+fileMagic = b'NEAGAMES'
+indexMagic = b'NEAINDEX'
+archiveVersion = 1
+fileHeaderFormat = struct.Struct('<8sI')
+gameHeaderFormat = struct.Struct('<BBHI')
+footerFormat = struct.Struct('<QQ8s')
+results = ['1-0', '1/2-1/2', '0-1', '*']  # Stored as the index in this list
+startingFen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+'''
+Writes games to a new archive. close has to be called (or the writer used in a with statement) to write the index
+'''
+class ArchiveWriter:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(fileHeaderFormat.pack(fileMagic, archiveVersion))
+        self.offsets = array('Q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+    '''
+    Adds the game in the move log. The start position is found by taking the moves back, then they are made again
+    '''
+    def add_game(self, gs, result='*'):
+        moves = list(gs.moveLog)
+        for move in moves:
+            gs.undo_move()
+        start_fen = gs.get_fen()
+        for move in moves:
+            gs.make_move(move)
+        self.add_moves([move.get_move_code() for move in moves], start_fen, result)
+
+    '''
+    Adds a game from its move codes, for games that were never made in a GameState
+    '''
+    def add_moves(self, move_codes, start_fen=startingFen, result='*'):
+        fen = b'' if start_fen == startingFen else start_fen.encode('ascii')
+        codes = array('H', move_codes)
+        if sys.byteorder != 'little':
+            codes.byteswap()
+        self.offsets.append(self.file.tell())
+        self.file.write(gameHeaderFormat.pack(results.index(result), 0, len(fen), len(codes)))
+        self.file.write(fen)
+        self.file.write(codes.tobytes())
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        offsets = array('Q', self.offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        self.file.write(offsets.tobytes())
+        self.file.write(footerFormat.pack(index_offset, len(self.offsets), indexMagic))
+        self.file.close()
+
+
+'''
+The header of a game in the archive
+'''
+class ArchivedGame:
+    def __init__(self, number, result, start_fen, moves):
+        self.number = number
+        self.result = result
+        self.startFen = start_fen
+        self.moves = moves  # The move codes, an array('H')
+
+    def __len__(self):
+        return len(self.moves)
+
+    '''
+    Makes the moves in a new GameState and returns it
+    '''
+    def replay(self):
+        gs = ChessEngine.GameState()
+        if self.startFen != startingFen:
+            gs.load_fen(self.startFen)
+        for code in self.moves:
+            move = gs.get_move_from_code(code)
+            if move is None:
+                raise ValueError('Game ' + str(self.number) + ' has an invalid move at ply ' + str(len(gs.moveLog)))
+            gs.make_move(move)
+        return gs
+
+
+'''
+Reads an archive through a memory map. Opening it only reads the footer, and getting a game only reads the pages
+that game is on. The moves are copied out of the map (two bytes each) so that games can be kept after the reader
+is closed
+'''
+class ArchiveReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = fileHeaderFormat.unpack_from(self.data, 0)
+        index_offset, self.size, magic_at_end = footerFormat.unpack_from(self.data, len(self.data) - footerFormat.size)
+        if magic != fileMagic or magic_at_end != indexMagic:
+            self.close()
+            raise ValueError(path + ' is not a game archive or was not closed properly')
+        if version != archiveVersion:
+            self.close()
+            raise ValueError(path + ' is archive version ' + str(version) + ', only version ' +
+                             str(archiveVersion) + ' can be read')
+        self.indexOffset = index_offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for number in range(self.size):
+            yield self.get_game(number)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def get_offset(self, number):
+        return struct.unpack_from('<Q', self.data, self.indexOffset + number * 8)[0]
+
+    '''
+    Jumps straight to game number (counting from 0) with the index
+    '''
+    def get_game(self, number):
+        if not 0 <= number < self.size:
+            raise IndexError('The archive has ' + str(self.size) + ' games, there is no game ' + str(number))
+        offset = self.get_offset(number)
+        result, reserved, fen_length, move_count = gameHeaderFormat.unpack_from(self.data, offset)
+        offset += gameHeaderFormat.size
+        start_fen = self.data[offset:offset + fen_length].decode('ascii') if fen_length != 0 else startingFen
+        offset += fen_length
+        moves = array('H')
+        moves.frombytes(self.data[offset:offset + move_count * 2])
+        if sys.byteorder != 'little':
+            moves.byteswap()
+        return ArchivedGame(number, results[result], start_fen, moves)
@@ -0,0 +1,276 @@
+"""
+This file gives the two rule implementations in the repo - ChessEngine.GameState and
+board.Board with pieces - the same small interface, so either one can be used as the
+backend. Positions are loaded from FEN and moves are passed around as UCI strings
+('e2e4', 'e7e8q') because the two use different coordinates and Move classes.
+
+Running this file plays random games on both backends and checks that they agree on
+the legal moves in every position (differential perft fuzzing).
+Usage: python ChessBackends.py [games] [plies per game] [seed]
+"""
+import copy
+import random
+import sys
+
+import ChessEngine
+import board
+import pieces
+
+startingFen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+files = 'abcdefgh'
+
+
+'''
+Backend for ChessEngine.GameState - rows and columns, row 0 is the 8th rank
+'''
+class GameStateBackend:
+    name = 'GameState'
+
+    def __init__(self):
+        self.gs = ChessEngine.GameState()
+
+    def load_position(self, fen):
+        self.gs.load_fen(fen)
+
+    def fen(self):
+        return self.gs.get_fen()
+
+    def legal_moves(self):
+        moves = []
+        for move in self.gs.get_valid_moves():
+            uci = move.get_move_in_chess_notation()
+            if move.isPawnPromotion:  # GameState has one move for a promotion, the piece is picked when it is made
+                moves += [uci + piece for piece in 'qrbn']
+            else:
+                moves.append(uci)
+        return moves
+
+    def make_move(self, uci):
+        for move in self.gs.get_valid_moves():
+            if move.get_move_in_chess_notation() == uci[:4]:
+                if move.isPawnPromotion:
+                    move = copy.copy(move)  # Leaves the move in the move cache as it is
+                    move.promotionChoice = uci[4].upper() if len(uci) > 4 else 'Q'
+                self.gs.make_move(move)
+                return
+        raise ValueError('Illegal move for ' + self.name + ': ' + uci)
+
+    def unmake_move(self):
+        self.gs.undo_move()
+
+    def hash(self):
+        return self.gs.hashKey
+
+
+
+'''
+Backend for board.Board - x is the file and y is the row, y = 0 is the 8th rank.
+The board always promotes to a queen and has no en passant
+'''
+class BoardBackend:
+    name = 'Board'
+
+    def __init__(self):
+        self.load_position(startingFen)
+
+    def load_position(self, fen):
+        self.board = board.Board.from_fen(fen)
+        fields = fen.split()
+        self.colour = pieces.Piece.WHITE if len(fields) < 2 or fields[1] == 'w' else pieces.Piece.BLACK
+        self.tokens = []  # Undo tokens of the moves made since the position was loaded
+
+    def fen(self):
+        ranks = []
+        for y in range(board.Board.HEIGHT):
+            rank = ''
+            empty = 0
+            for x in range(board.Board.WIDTH):
+                piece = self.board.chesspieces[x][y]
+                if piece == 0:
+                    empty += 1
+                    continue
+                if empty != 0:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece.piece_type if piece.color == pieces.Piece.WHITE else piece.piece_type.lower()
+            if empty != 0:
+                rank += str(empty)
+            ranks.append(rank)
+        return ' '.join(['/'.join(ranks), 'w' if self.colour == pieces.Piece.WHITE else 'b',
+                         self.castling_rights() or '-', '-', '0', '1'])
+
+    def legal_moves(self):
+        return [self.to_uci(move) for move in self.board.get_legal_moves(self.colour)]
+
+    def make_move(self, uci):
+        for move in self.board.get_legal_moves(self.colour):
+            if self.to_uci(move) == uci:
+                self.tokens.append(self.board.perform_move(move))
+                self.colour = pieces.Piece.BLACK if self.colour == pieces.Piece.WHITE else pieces.Piece.WHITE
+                return
+        raise ValueError('Illegal move for ' + self.name + ': ' + uci)
+
+    def unmake_move(self):
+        self.board.undo_move(self.tokens.pop())
+        self.colour = pieces.Piece.BLACK if self.colour == pieces.Piece.WHITE else pieces.Piece.WHITE
+
+    '''
+    Uses the same Zobrist numbers as GameState. The board has no en passant and only knows whether the
+    kings have moved, so castle rights are taken as an unmoved king with its rook still in the corner
+    '''
+    def hash(self):
+        hash_key = 0
+        for x in range(board.Board.WIDTH):
+            for y in range(board.Board.HEIGHT):
+                piece = self.board.chesspieces[x][y]
+                if piece != 0:
+                    name = piece.color.lower() + ('p' if piece.piece_type == pieces.Pawn.PIECE_TYPE else piece.piece_type)
+                    hash_key ^= ChessEngine.zobristPieces[name][y * 8 + x]
+        castle_bits = 0
+        for letter, bit in (('K', ChessEngine.whiteKingSideBit), ('Q', ChessEngine.whiteQueenSideBit),
+                            ('k', ChessEngine.blackKingSideBit), ('q', ChessEngine.blackQueenSideBit)):
+            if letter in self.castling_rights():
+                castle_bits |= bit
+        hash_key ^= ChessEngine.zobristCastleRights[castle_bits]
+        if self.colour == pieces.Piece.BLACK:
+            hash_key ^= ChessEngine.zobristBlackToMove
+        return hash_key
+
+    def castling_rights(self):
+        rights = ''
+        for letter, y, king_moved, colour, x in (('K', 7, self.board.white_king_moved, pieces.Piece.WHITE, 7),
+                                                 ('Q', 7, self.board.white_king_moved, pieces.Piece.WHITE, 0),
+                                                 ('k', 0, self.board.black_king_moved, pieces.Piece.BLACK, 7),
+                                                 ('q', 0, self.board.black_king_moved, pieces.Piece.BLACK, 0)):
+            rook = self.board.chesspieces[x][y]
+            if not king_moved and rook != 0 and rook.piece_type == pieces.Rook.PIECE_TYPE and rook.color == colour:
+                rights += letter
+        return rights
+
+    def to_uci(self, move):
+        uci = files[move.xfrom] + str(8 - move.yfrom) + files[move.xto] + str(8 - move.yto)
+        piece = self.board.chesspieces[move.xfrom][move.yfrom]
+        if piece.piece_type == pieces.Pawn.PIECE_TYPE and move.yto in (0, board.Board.HEIGHT - 1):
+            uci += 'q'
+        return uci
+
+
+backends = {GameStateBackend.name: GameStateBackend, BoardBackend.name: BoardBackend}
+
+
+def create_backend(name):
+    return backends[name]()
+
+
+'''
+Counts the leaf positions of the move tree to the given depth
+'''
+def perft(backend, depth):
+    if depth == 0:
+        return 1
+    count = 0
+    for uci in backend.legal_moves():
+        backend.make_move(uci)
+        count += perft(backend, depth - 1)
+        backend.unmake_move()
+    return count
+
+
+'''
+Castling, en passant and under-promotion are left out of the comparison because board.Board doesn't implement all
+of their rules (no en passant, castling rights only go when the king moves and it can castle out of or through
+check, pawns always promote to a queen)
+'''
+def is_special_move(fen, uci):
+    if len(uci) > 4 and uci[4] != 'q':
+        return True
+    rows = fen.split()[0].split('/')
+    squares = []
+    for rank in rows:
+        for character in rank:
+            squares += ['.'] * int(character) if character.isdigit() else [character]
+    start = squares[(8 - int(uci[1])) * 8 + files.index(uci[0])]
+    end = squares[(8 - int(uci[3])) * 8 + files.index(uci[2])]
+    file_change = abs(files.index(uci[2]) - files.index(uci[0]))
+    if start.upper() == 'K' and file_change == 2:
+        return True
+    return start.upper() == 'P' and file_change == 1 and end == '.'
+
+
+def comparable_moves(backend, fen):
+    return set(uci for uci in backend.legal_moves() if not is_special_move(fen, uci))
+
+
+'''
+Walks both move trees together to the given depth and returns the first position where they disagree, or None
+'''
+def compare_trees(first, second, depth):
+    fen = first.fen()
+    first_moves = comparable_moves(first, fen)
+    second_moves = comparable_moves(second, fen)
+    if first_moves != second_moves:
+        return {'fen': fen, 'only' + first.name: sorted(first_moves - second_moves),
+                'only' + second.name: sorted(second_moves - first_moves)}
+    if depth > 1:
+        for uci in sorted(first_moves):
+            first.make_move(uci)
+            second.make_move(uci)
+            mismatch = compare_trees(first, second, depth - 1)
+            first.unmake_move()
+            second.unmake_move()
+            if mismatch is not None:
+                return mismatch
+    return None
+
+
+'''
+Plays random games with moves both backends allow and compares the legal moves in every position.
+Every tree_interval plies the whole tree to tree_depth is compared too. Returns the list of mismatches
+'''
+def fuzz(games=100, max_plies=200, seed=0, tree_depth=2, tree_interval=10, start_fen=startingFen):
+    rng = random.Random(seed)
+    mismatches = []
+    for game in range(games):
+        first = GameStateBackend()
+        second = BoardBackend()
+        first.load_position(start_fen)
+        second.load_position(start_fen)
+        for ply in range(max_plies):
+            placement = first.fen().split()[0]
+            if placement != second.fen().split()[0]:
+                mismatches.append({'game': game, 'ply': ply, 'fen': first.fen(), 'boardFen': second.fen()})
+                break
+            mismatch = compare_trees(first, second, tree_depth if ply % tree_interval == 0 else 1)
+            if mismatch is not None:
+                mismatch.update({'game': game, 'ply': ply})
+                mismatches.append(mismatch)
+                break
+            moves = sorted(comparable_moves(first, first.fen()))
+            if len(moves) == 0:
+                break
+            uci = rng.choice(moves)
+            first.make_move(uci)
+            second.make_move(uci)
+
+        # Taking every move back has to get both backends to the start again
+        while len(first.gs.moveLog) != 0:
+            first.unmake_move()
+            second.unmake_move()
+        if first.fen().split()[0] != start_fen.split()[0] or second.fen().split()[0] != start_fen.split()[0]:
+            mismatches.append({'game': game, 'unmake': True, 'fen': first.fen(), 'boardFen': second.fen()})
+    return mismatches
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    max_plies = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    mismatches = fuzz(games, max_plies, seed)
+    for mismatch in mismatches:
+        print(mismatch)
+    print(str(len(mismatches)) + ' mismatches in ' + str(games) + ' games')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
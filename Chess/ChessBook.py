@@ -0,0 +1,262 @@
+"""
+This file builds and reads the opening book. The book is a binary file of fixed size entries,
+sorted by position hash and then move, so the moves of a position are found with a binary search:
+
+    position hash   uint64   (GameState.hashKey)
+    move            uint16   (Move.get_move_code)
+    white wins      uint32
+    draws           uint32
+    black wins      uint32
+
+all little-endian. The builder splits the PGN files into chunks that are replayed by a process pool.
+Each worker counts the games of its chunk into a sorted run file in the same format, and the runs are
+merged into the book with an external merge sort, so memory use doesn't depend on the number of games.
+Usage: python ChessBook.py book.bin games.pgn [more.pgn ...]
+"""
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessPGN
+
+entryFormat = struct.Struct('<QHIII')
+bookPlyLimit = 30  # Only the first moves of each game go in the book
+chunkSize = 1 << 24  # Bytes of PGN each worker task reads
+# A worker writes out its counts as a sorted run once it has this many. Each entry is a tuple key and a list of
+# counts in a dict, around 300 bytes, so this is about 75 MB per worker process
+runEntryLimit = 1 << 18
+mergeFanIn = 256  # Runs merged at once, well under the usual limit of 1024 open files
+resultIndexes = {'1-0': 0, '1/2-1/2': 1, '0-1': 2}
+
+
+'''
+Returns the byte offsets where the chunks of the file start. Every chunk starts on the first tag of a game
+'''
+def find_chunk_starts(path):
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, 'rb') as file:
+        while starts[-1] + chunkSize < size:
+            file.seek(starts[-1] + chunkSize)
+            file.readline()  # Probably the middle of a line
+            while True:
+                offset = file.tell()
+                line = file.readline()
+                if line == b'':
+                    return starts
+                if line.startswith(b'[Event '):
+                    starts.append(offset)
+                    break
+    return starts
+
+
+'''
+Yields the lines of the file from the start offset up to the end offset as strings
+'''
+def read_chunk_lines(file, start, end):
+    file.seek(start)
+    offset = start
+    while offset < end:
+        line = file.readline()
+        if line == b'':
+            break
+        offset += len(line)
+        yield line.decode('utf-8', 'replace')
+
+
+'''
+Sorts the counts and writes them to a new run file, returns its path
+'''
+def write_run(counts, directory):
+    handle, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with os.fdopen(handle, 'wb') as file:
+        for (hash_key, move_code), (white, draws, black) in sorted(counts.items()):
+            file.write(entryFormat.pack(hash_key, move_code, white, draws, black))
+    return path
+
+
+'''
+The worker task - replays the games in one chunk and counts the results of each move played in each position.
+Returns the paths of its run files, the number of games counted and the number of unfinished games skipped
+'''
+def count_chunk(path, start, end, ply_limit, directory):
+    counts = {}
+    runs = []
+    games = 0
+    skipped = 0
+    with open(path, 'rb') as file:
+        for headers, gs in ChessPGN.read_games(read_chunk_lines(file, start, end), ply_limit, skip_invalid=True):
+            result = resultIndexes.get(headers.get('Result'))
+            if result is None:  # Unfinished games don't say anything about the moves
+                skipped += 1
+                continue
+            games += 1
+            for ply, move in enumerate(gs.moveLog):
+                key = (gs.hashHistory[ply], move.get_move_code())  # hashHistory has the hash from before each move
+                if key not in counts:
+                    counts[key] = [0, 0, 0]
+                counts[key][result] += 1
+            if len(counts) >= runEntryLimit:
+                runs.append(write_run(counts, directory))
+                counts = {}
+    if len(counts) != 0:
+        runs.append(write_run(counts, directory))
+    return runs, games, skipped
+
+
+def read_entries(path):
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(entryFormat.size * 4096)
+            if data == b'':
+                return
+            yield from entryFormat.iter_unpack(data)
+
+
+'''
+Yields the entries of the sorted runs in order, with the counts of the same move in the same position added up
+'''
+def merge_entries(runs):
+    current = None
+    for hash_key, move_code, white, draws, black in heapq.merge(*[read_entries(run) for run in runs]):
+        if current is not None and current[0] == hash_key and current[1] == move_code:
+            current[2] += white
+            current[3] += draws
+            current[4] += black
+            continue
+        if current is not None:
+            yield current
+        current = [hash_key, move_code, white, draws, black]
+    if current is not None:
+        yield current
+
+
+'''
+Merges the sorted runs into the book. Only mergeFanIn runs are open at once - with more than that they are merged
+in passes into bigger runs in directory first. Moves played in fewer than min_games games are left out.
+Returns the number of entries written
+'''
+def merge_runs(runs, book_path, min_games=1, directory=None):
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(book_path))
+    merged_runs = []  # Made by the passes, removed as soon as the next pass has merged them
+    try:
+        while len(runs) > mergeFanIn:
+            next_runs = []
+            for start in range(0, len(runs), mergeFanIn):
+                handle, path = tempfile.mkstemp(suffix='.run', dir=directory)
+                merged_runs.append(path)
+                with os.fdopen(handle, 'wb') as file:
+                    for entry in merge_entries(runs[start:start + mergeFanIn]):
+                        file.write(entryFormat.pack(*entry))
+                next_runs.append(path)
+            for run in runs:  # The caller's own runs are left for it to remove
+                if run in merged_runs:
+                    os.remove(run)
+                    merged_runs.remove(run)
+            runs = next_runs
+
+        entries = 0
+        with open(book_path, 'wb') as book:
+            for entry in merge_entries(runs):
+                if sum(entry[2:]) >= min_games:
+                    book.write(entryFormat.pack(*entry))
+                    entries += 1
+        return entries
+    finally:
+        for run in merged_runs:
+            os.remove(run)
+
+
+'''
+Builds the book from the PGN files with a process pool. Returns (games, skipped games, book entries)
+'''
+def build_book(pgn_paths, book_path, ply_limit=bookPlyLimit, workers=None, min_games=1):
+    directory = tempfile.mkdtemp(prefix='book', dir=os.path.dirname(os.path.abspath(book_path)))
+    runs = []
+    games = 0
+    skipped = 0
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            tasks = []
+            for path in pgn_paths:
+                starts = find_chunk_starts(path)
+                ends = starts[1:] + [os.path.getsize(path)]
+                for start, end in zip(starts, ends):
+                    tasks.append(executor.submit(count_chunk, path, start, end, ply_limit, directory))
+            for task in tasks:
+                task_runs, task_games, task_skipped = task.result()
+                runs += task_runs
+                games += task_games
+                skipped += task_skipped
+        entries = merge_runs(runs, book_path, min_games, directory)
+    finally:
+        for run in runs:
+            os.remove(run)
+        for leftover in os.listdir(directory):  # Runs of workers that failed
+            os.remove(os.path.join(directory, leftover))
+        os.rmdir(directory)
+    return games, skipped, entries
+
+
+'''
+Reads a book file. The file is memory mapped, so opening it is instant and only the pages that are searched are read
+'''
+class OpeningBook:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.size = os.path.getsize(path) // entryFormat.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size != 0 else b''
+
+    def close(self):
+        if self.size != 0:
+            self.data.close()
+        self.file.close()
+
+    def get_hash_key(self, index):
+        return struct.unpack_from('<Q', self.data, index * entryFormat.size)[0]
+
+    '''
+    Returns (move code, white wins, draws, black wins) for every move of the position in the book
+    '''
+    def get_entries(self, hash_key):
+        low, high = 0, self.size
+        while low < high:  # The first entry with this hash key or a bigger one
+            middle = (low + high) // 2
+            if self.get_hash_key(middle) < hash_key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.size and self.get_hash_key(low) == hash_key:
+            entries.append(entryFormat.unpack_from(self.data, low * entryFormat.size)[1:])
+            low += 1
+        return entries
+
+    '''
+    Returns (move, white wins, draws, black wins) for the book moves that are valid in the position, most played first
+    '''
+    def get_moves(self, gs):
+        moves = []
+        for move_code, white, draws, black in self.get_entries(gs.hashKey):
+            move = gs.get_move_from_code(move_code)
+            if move is not None:  # Two positions can share a hash key
+                moves.append((move, white, draws, black))
+        moves.sort(key=lambda entry: sum(entry[1:]), reverse=True)
+        return moves
+
+
+def main():
+    if len(sys.argv) < 3:
+        print('Usage: python ChessBook.py book.bin games.pgn [more.pgn ...]')
+        sys.exit(2)
+    games, skipped, entries = build_book(sys.argv[2:], sys.argv[1])
+    print(str(games) + ' games (' + str(skipped) + ' skipped), ' + str(entries) + ' book entries')
+
+
+if __name__ == '__main__':
+    main()
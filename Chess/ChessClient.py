@@ -0,0 +1,108 @@
+"""
+This file is a client for ChessServer. It can be used from code that isn't asyncio, like the pygame loop
+in ChessMain. Requests are sent straight away and a background thread reads the responses, so a slow AI
+search doesn't stop other requests (or the screen) from carrying on.
+"""
+import json
+import socket
+import threading
+from concurrent.futures import Future
+
+
+class ServerError(Exception):
+    pass
+
+
+class ChessClient:
+    '''
+    address is (host, port) for TCP or a path for a Unix socket
+    '''
+    def __init__(self, address):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        self.file = self.socket.makefile('rb')
+        self.sendLock = threading.Lock()
+        self.waiting = {}  # Request id -> the Future its response goes into
+        self.nextId = 1
+        self.closed = False  # Set once the connection has gone, nothing sent after that would be answered
+        self.reader = threading.Thread(target=self.read_responses, daemon=True)
+        self.reader.start()
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def read_responses(self):
+        try:
+            for line in self.file:
+                response = json.loads(line)
+                future = self.waiting.pop(response.get('id'), None)
+                if future is None:
+                    continue
+                if 'error' in response:
+                    future.set_exception(ServerError(response['error']))
+                else:
+                    future.set_result(response)
+        except (OSError, ValueError):
+            pass
+        with self.sendLock:  # So that submit can't add a Future after the ones waiting have been failed
+            self.closed = True
+            waiting = list(self.waiting.values())
+            self.waiting.clear()
+        for future in waiting:  # The connection has gone, nothing else will be answered
+            future.set_exception(ServerError('The connection to the server was closed'))
+
+    '''
+    Sends the request and returns a Future for its response, without waiting for it.
+    Raises a ServerError if the connection to the server has gone
+    '''
+    def submit(self, request):
+        future = Future()
+        with self.sendLock:
+            if self.closed:
+                raise ServerError('The connection to the server was closed')
+            request_id = self.nextId
+            self.nextId += 1
+            self.waiting[request_id] = future
+            try:
+                self.socket.sendall((json.dumps(dict(request, id=request_id)) + '\n').encode())
+            except OSError as error:
+                del self.waiting[request_id]
+                raise ServerError('The request could not be sent: ' + str(error))
+        return future
+
+    '''
+    Sends the request and waits for the response. Raises a ServerError if the server answers with an error
+    '''
+    def request(self, request, timeout=None):
+        return self.submit(request).result(timeout)
+
+    def new_game(self, fen=None):
+        return self.request({'type': 'new_game'} if fen is None else {'type': 'new_game', 'fen': fen})
+
+    def make_move(self, game_id, uci):
+        return self.request({'type': 'move', 'game': game_id, 'move': uci})
+
+    def undo_move(self, game_id):
+        return self.request({'type': 'undo', 'game': game_id})
+
+    def close_game(self, game_id):
+        return self.request({'type': 'close_game', 'game': game_id})
+
+    def get_metrics(self):
+        return self.request({'type': 'metrics'})
+
+    '''
+    Asks for the AI's move with the named ChessAI profile and returns a Future of the response, which has the move
+    in its 'move' key.
+    With apply False the server doesn't make the move, the client tells it which move was played with make_move
+    '''
+    def submit_ai_move(self, game_id, time_limit, apply=True, profile='club'):
+        return self.submit({'type': 'ai_move', 'game': game_id, 'timeLimit': time_limit, 'apply': apply,
+                            'profile': profile})
@@ -2,8 +2,49 @@
 This file is responsible for storing all the information about the
 state of the Chess Game. It is also responsible for validating moves
 made by the user. It will also keep a move log.
+It doesn't use pygame so that the engine can be imported without a display.
 """
-import pygame
+import random
+from array import array
+from collections import OrderedDict
+
+# Each piece gets a small number so that it can be packed into the undo records
+pieceCodes = {'--': 0, 'wp': 1, 'wN': 2, 'wB': 3, 'wR': 4, 'wQ': 5, 'wK': 6,
+              'bp': 9, 'bN': 10, 'bB': 11, 'bR': 12, 'bQ': 13, 'bK': 14}
+codePieces = {v: k for k, v in pieceCodes.items()}
+
+# Castle rights are kept as 4 bits in the undo records and the hash
+whiteKingSideBit = 1
+whiteQueenSideBit = 2
+blackKingSideBit = 4
+blackQueenSideBit = 8
+
+# How much each piece counts towards the game phase. All the pieces at the start add up to maxPhase,
+# and the phase goes down towards 0 (the endgame) as pieces are captured
+phaseWeights = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+maxPhase = 24
+
+# Piece values for the static exchange evaluation. The king is worth more than everything else together,
+# so an exchange where it would be taken is never worth it
+exchangeValues = {'p': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 100}
+
+# Promotion pieces in the 16 bit move codes (0 is not a promotion)
+promotionCodes = {'N': 1, 'B': 2, 'R': 3, 'Q': 4}
+codePromotions = {v: k for k, v in promotionCodes.items()}
+
+noEnpassantFile = 8  # Stored instead of a file (0-7) when en passant is not possible
+undoStackSize = 512  # Number of undo records allocated up front, doubled whenever a game gets longer than this
+moveCacheSize = 4096  # Number of positions each GameState remembers the valid moves of
+
+# Zobrist hashing - every piece on every square, each set of castle rights, each en passant file and
+# the side to move has a random 64 bit number. The hash of a position is all of its numbers XORed together.
+# The seed is fixed so that every process gives the same position the same hash.
+zobristRandom = random.Random(20240101)
+zobristPieces = {piece: [zobristRandom.getrandbits(64) for square in range(64)]
+                 for piece in pieceCodes if piece != '--'}
+zobristCastleRights = [zobristRandom.getrandbits(64) for rights in range(16)]
+zobristEnpassantFiles = [zobristRandom.getrandbits(64) for file in range(8)] + [0]  # No en passant adds nothing
+zobristBlackToMove = zobristRandom.getrandbits(64)
 
 
 class GameState:
@@ -40,9 +81,9 @@ class GameState:
 
         self.isKingInCheck = False
         self.pins = []  # list of pinned pieces
+        self.foundPins = []  # All the pins of the position, self.pins loses them as the moves are generated
         self.checks = []
         self.enpassantPossible = ()  # These are the coordinates for the square where it is possible to do en passant
-        self.enPassantHistory = [self.enpassantPossible]
         self.checkmate = False
         self.stalemate = False
 
@@ -52,11 +93,35 @@ class GameState:
         self.whiteCanCastleKingSide = True
         self.blackCanCastleQueenSide = True
         self.blackCanCastleKingSide = True
-        self.castlingHistory = [CastleRights(self.whiteCanCastleKingSide, self.blackCanCastleKingSide,
-                                             self.whiteCanCastleQueenSide,
-                                             self.blackCanCastleQueenSide)]  # Keeps track of the castles available
+
+        self.halfmoveClock = 0  # Moves since the last capture or pawn move, for the 50 move rule
+        self.hashKey = self.compute_hash()
+        self.pawnHashKey = self.compute_pawn_hash()  # Only the pawns, for the AI's pawn structure table
+        self.phase = self.compute_phase()  # Kept up to date by make_move and undo_move so the AI never counts pieces
+
+        # One undo record per move in the move log, at the same index. Each record is a single int holding the
+        # castle rights, en passant file, captured piece and halfmove clock from before the move was made.
+        # The hash key from before the move is kept at the same index of hashHistory.
+        self.undoStack = array('L', [0]) * undoStackSize
+        self.hashHistory = array('Q', [0]) * undoStackSize
+
+        # The valid moves (and check, pin, checkmate and stalemate results) of recently seen positions, by hash key.
+        # Every make_move and undo_move changes the hash key, so a position can only ever find its own moves
+        self.moveCache = MoveCache(moveCacheSize)
 
     def make_move(self, move):
+        self.push_undo_record(move)
+        if move.pieceMoved[1] == 'p' or move.pieceCaptured[1] == 'p':
+            self.pawnHashKey ^= self.pawn_hash_change(move)
+        if move.pieceCaptured != '--':
+            self.phase -= phaseWeights[move.pieceCaptured[1]]
+        if move.isPawnPromotion:
+            self.phase += phaseWeights[move.promotionChoice]
+        hash_key = self.hashKey ^ zobristPieces[move.pieceMoved][move.startRow * 8 + move.startCol]
+        if move.pieceCaptured != '--' and not move.isEnpassantMove:
+            hash_key ^= zobristPieces[move.pieceCaptured][move.endRow * 8 + move.endCol]
+        hash_key ^= zobristCastleRights[self.castle_rights_bits()] ^ zobristEnpassantFiles[self.enpassant_file()]
+
         self.board[move.endRow][move.endCol] = move.pieceMoved  # new position of the piece on the board
         self.board[move.startRow][move.startCol] = '--'  # Replaces the initial position of the piece with a blank space
         self.moveLog.append(move)  # Keeps track of the move in order to undo
@@ -68,28 +133,16 @@ class GameState:
         elif move.pieceMoved == 'bK':
             self.BlackKingPosition = (move.endRow, move.endCol)
 
-        # Pawn Promotion
-        running = True
+        # Pawn Promotion - the piece is chosen before the move is made (the AI always picks a Queen)
         if move.isPawnPromotion:
-            while running:
-                for event in pygame.event.get():
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_q:
-                            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
-                            running = False
-                        if event.key == pygame.K_r:
-                            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'R'
-                            running = False
-                        if event.key == pygame.K_b:
-                            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'B'
-                            running = False
-                        if event.key == pygame.K_k:
-                            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'N'
-                            running = False
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
+
+        hash_key ^= zobristPieces[self.board[move.endRow][move.endCol]][move.endRow * 8 + move.endCol]  # After promotion
 
         # En Passant Move
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = '--'  # Captures the pawn
+            hash_key ^= zobristPieces[move.pieceCaptured][move.startRow * 8 + move.endCol]
 
         # Updating the enpassant possible variable
         if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
@@ -98,29 +151,55 @@ class GameState:
         else:
             self.enpassantPossible = ()
 
-        self.enPassantHistory.append(self.enpassantPossible)
-
         # Updating the rights to castle - Only when the rook or the king moves
         self.update_castle_rights(move)
-        self.castlingHistory.append(CastleRights(self.whiteCanCastleKingSide, self.blackCanCastleKingSide,
-                                                 self.whiteCanCastleQueenSide, self.blackCanCastleQueenSide))
 
         # Castling Moves
         if move.castle:
             if move.endCol - move.startCol == 2:  # King_side castle
                 self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol + 1]  # Moves the rook
                 self.board[move.endRow][move.endCol + 1] = '--'  # Empty space where the Rook was
+                rook_start, rook_end = move.endCol + 1, move.endCol - 1
             else:  # Queen_side Castling
                 self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2]  # Moves the rook
                 self.board[move.endRow][move.endCol - 2] = '--'  # Empty space where the Rook was
+                rook_start, rook_end = move.endCol - 2, move.endCol + 1
+            rook = self.board[move.endRow][rook_end]
+            hash_key ^= zobristPieces[rook][move.endRow * 8 + rook_start] ^ zobristPieces[rook][move.endRow * 8 + rook_end]
+
+        # The 50 move rule only counts moves that are not captures or pawn moves
+        if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+
+        self.hashKey = hash_key ^ zobristCastleRights[self.castle_rights_bits()] ^ \
+            zobristEnpassantFiles[self.enpassant_file()] ^ zobristBlackToMove
 
     '''
     function for valid moves
     '''
 
     def get_valid_moves(self):
-        moves = self.get_all_possible_moves()  # Collect all possible moves first
+        cached = self.moveCache.get(self.hashKey)
+        if cached is not None:
+            moves, self.isKingInCheck, pins, self.checks, self.checkmate, self.stalemate = cached
+            self.pins = list(pins)
+            return list(moves)  # A copy so that the caller can shuffle or change it
+
+        moves = self.generate_valid_moves()
+        self.moveCache.put(self.hashKey, (tuple(moves), self.isKingInCheck, tuple(self.foundPins), self.checks,
+                                          self.checkmate, self.stalemate))
+        return moves
+
+    '''
+    Generates the valid moves without using the move cache
+    '''
+    def generate_valid_moves(self):
+        # The pins have to be found before the moves are generated because the piece functions use them
         self.isKingInCheck, self.pins, self.checks = self.check_for_pins_and_checks()
+        self.foundPins = list(self.pins)  # The piece functions remove pins from self.pins as they use them
+        moves = self.get_all_possible_moves()  # Collect all possible moves
 
         if self.isKingInCheck:
             # If the king is in check, we need to filter the moves
@@ -144,8 +223,9 @@ class GameState:
                             break
 
                 # Filter moves to only those that either move the king or block/capture the checking piece
+                # En passant moves have already been tested by making them, so they are kept
                 moves = [move for move in moves if
-                         move.pieceMoved[1] == 'K' or (move.endRow, move.endCol) in valid_moves]
+                         move.pieceMoved[1] == 'K' or move.isEnpassantMove or (move.endRow, move.endCol) in valid_moves]
 
             else:  # Double check scenario
                 # The king must move in a double check
@@ -170,10 +250,20 @@ class GameState:
         if len(self.moveLog) != 0: #Makes sure that the user has made a move previously
 
             move = self.moveLog.pop() #returns and deletes the last move
+            record = self.undoStack[len(self.moveLog)]  # The undo record was stored at the same index as the move
+            self.hashKey = self.hashHistory[len(self.moveLog)]
+            piece_captured = codePieces[(record >> 8) & 15]
+            self.halfmoveClock = record >> 12
+            if move.pieceMoved[1] == 'p' or move.pieceCaptured[1] == 'p':
+                self.pawnHashKey ^= self.pawn_hash_change(move)  # XOR undoes itself
+            if piece_captured != '--':
+                self.phase += phaseWeights[piece_captured[1]]
+            if move.isPawnPromotion:
+                self.phase -= phaseWeights[self.board[move.endRow][move.endCol][1]]  # The piece it was promoted to
 
             self.board[move.startRow][move.startCol] = move.pieceMoved
 
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.board[move.endRow][move.endCol] = piece_captured
 
             self.whiteToMove = not self.whiteToMove #Switches turns back to original user
 
@@ -190,20 +280,18 @@ class GameState:
                 self.board[move.endRow][move.endCol] = '--'
                 #Removes the pawn that was moved
 
-                self.board[move.startRow][move.endCol] = move.pieceCaptured #Puts the opponent's pawn back onto the correct square
-
-                self.enPassantHistory.pop() #Gets rid of the last item
+                self.board[move.startRow][move.endCol] = piece_captured #Puts the opponent's pawn back onto the correct square
 
-                self.enpassantPossible = self.enPassantHistory[-1]
-                #sets the new items to the value of the last item in the log
+            #Restoring the en passant square from the record
+            enpassant_file = (record >> 4) & 15
+            if enpassant_file == noEnpassantFile:
+                self.enpassantPossible = ()
+            else:
+                # The pawn that could be captured belongs to the other player, who made the move before this one
+                self.enpassantPossible = (2 if self.whiteToMove else 5, enpassant_file)
 
             #Undoing Castling Rights
-            self.castlingHistory.pop() #Getting rid of the new castle rights from the move that is being undone
-            castle_rights = self.castlingHistory[-1] #sets the current castle rights to the last one in the list
-            self.whiteCanCastleKingSide = castle_rights.whiteKingSide
-            self.blackCanCastleKingSide = castle_rights.blackKingSide
-            self.whiteCanCastleQueenSide = castle_rights.whiteQueenSide
-            self.blackCanCastleQueenSide = castle_rights.blackQueenSide
+            self.set_castle_rights_bits(record & 15)
 
             #Undoing a Castle
             if move.castle:
@@ -224,6 +312,219 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
+    '''
+    Counts how many times the current position has happened before. Only positions since the last capture or
+    pawn move can be the same, and only every other one has the same player to move, so that is all that is checked
+    '''
+    def repetition_count(self, stop_at=0):
+        count = 0
+        index = len(self.moveLog)
+        for plies_back in range(2, min(self.halfmoveClock, index) + 1, 2):
+            if self.hashHistory[index - plies_back] == self.hashKey:
+                count += 1
+                if count == stop_at:
+                    break
+        return count
+
+    def is_draw_by_repetition(self):
+        return self.repetition_count(2) >= 2  # The third time a position happens
+
+    def is_draw_by_fifty_move_rule(self):
+        return self.halfmoveClock >= 100  # 50 moves each without a capture or a pawn move
+
+    '''
+    Packs everything make_move cannot get back from the move itself into one int and saves it with the hash key
+    '''
+    def push_undo_record(self, move):
+        index = len(self.moveLog)
+        if index == len(self.undoStack):  # The game is longer than the space allocated so double it
+            self.undoStack.extend(array('L', [0]) * len(self.undoStack))
+            self.hashHistory.extend(array('Q', [0]) * len(self.hashHistory))
+        self.undoStack[index] = (self.castle_rights_bits() | self.enpassant_file() << 4 |
+                                 pieceCodes[move.pieceCaptured] << 8 | self.halfmoveClock << 12)
+        self.hashHistory[index] = self.hashKey
+
+    def castle_rights_bits(self):
+        return ((whiteKingSideBit if self.whiteCanCastleKingSide else 0) |
+                (whiteQueenSideBit if self.whiteCanCastleQueenSide else 0) |
+                (blackKingSideBit if self.blackCanCastleKingSide else 0) |
+                (blackQueenSideBit if self.blackCanCastleQueenSide else 0))
+
+    def set_castle_rights_bits(self, bits):
+        self.whiteCanCastleKingSide = bits & whiteKingSideBit != 0
+        self.whiteCanCastleQueenSide = bits & whiteQueenSideBit != 0
+        self.blackCanCastleKingSide = bits & blackKingSideBit != 0
+        self.blackCanCastleQueenSide = bits & blackQueenSideBit != 0
+
+    def enpassant_file(self):
+        return self.enpassantPossible[1] if self.enpassantPossible != () else noEnpassantFile
+
+    '''
+    Raises a ValueError if the FEN can't be loaded - the board has to have 8 ranks of 8 squares and one king
+    of each colour, and the other fields have to be readable if they are there
+    '''
+    @staticmethod
+    def check_fen(fen):
+        fields = fen.split() if isinstance(fen, str) else []
+        if len(fields) == 0:
+            raise ValueError('Invalid FEN: ' + repr(fen))
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError('Invalid FEN, the board needs 8 ranks: ' + fen)
+        for rank in ranks:
+            squares = 0
+            for character in rank:
+                if character in '12345678':
+                    squares += int(character)
+                elif character in 'pnbrqkPNBRQK':
+                    squares += 1
+                else:
+                    raise ValueError('Invalid FEN, ' + repr(character) + ' is not a piece: ' + fen)
+            if squares != 8:
+                raise ValueError('Invalid FEN, every rank needs 8 squares: ' + fen)
+        if fields[0].count('K') != 1 or fields[0].count('k') != 1:
+            raise ValueError('Invalid FEN, each side needs one king: ' + fen)
+        if len(fields) > 1 and fields[1] not in ('w', 'b'):
+            raise ValueError('Invalid FEN, the side to move has to be w or b: ' + fen)
+        if len(fields) > 2 and (fields[2] != '-' and fields[2].strip('KQkq') != ''):
+            raise ValueError('Invalid FEN, castling rights have to be - or made of KQkq: ' + fen)
+        if len(fields) > 3 and fields[3] != '-' and (len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or
+                                                    fields[3][1] not in Move.ranksToRows):
+            raise ValueError('Invalid FEN, the en passant square has to be - or a square: ' + fen)
+        if any(not field.isdigit() for field in fields[4:6]):
+            raise ValueError('Invalid FEN, the move counters have to be numbers: ' + fen)
+
+    '''
+    Sets up the position from a FEN string, e.g. 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1'.
+    The move log is cleared because the moves that led to the position aren't known.
+    Raises a ValueError, and leaves the position as it was, if the FEN isn't valid
+    '''
+    def load_fen(self, fen):
+        self.check_fen(fen)
+        fields = fen.split()
+        self.board = [['--'] * 8 for r in range(8)]
+        for r, rank in enumerate(fields[0].split('/')):
+            c = 0
+            for character in rank:
+                if character.isdigit():
+                    c += int(character)  # Number of empty squares
+                else:
+                    colour = 'w' if character.isupper() else 'b'
+                    piece = character.upper() if character.lower() != 'p' else 'p'
+                    self.board[r][c] = colour + piece
+                    if piece == 'K':
+                        if colour == 'w':
+                            self.WhiteKingPosition = (r, c)
+                        else:
+                            self.BlackKingPosition = (r, c)
+                    c += 1
+
+        self.whiteToMove = len(fields) < 2 or fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.whiteCanCastleKingSide = 'K' in castling
+        self.whiteCanCastleQueenSide = 'Q' in castling
+        self.blackCanCastleKingSide = 'k' in castling
+        self.blackCanCastleQueenSide = 'q' in castling
+        if len(fields) > 3 and fields[3] != '-':
+            self.enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        else:
+            self.enpassantPossible = ()
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+
+        self.moveLog = []
+        self.pins = []
+        self.foundPins = []
+        self.checks = []
+        self.isKingInCheck = False
+        self.checkmate = False
+        self.stalemate = False
+        self.hashKey = self.compute_hash()
+        self.pawnHashKey = self.compute_pawn_hash()
+        self.phase = self.compute_phase()
+
+    '''
+    Returns the valid move with the 16 bit code from Move.get_move_code, or None if there isn't one
+    '''
+    def get_move_from_code(self, code):
+        start_row, start_col = divmod(code & 63, 8)
+        end_row, end_col = divmod((code >> 6) & 63, 8)
+        promotion = code >> 12
+        for move in self.get_valid_moves():
+            if (move.startRow, move.startCol, move.endRow, move.endCol) == (start_row, start_col, end_row, end_col):
+                if promotion != 0 and codePromotions[promotion] != move.promotionChoice:
+                    move = Move((start_row, start_col), (end_row, end_col), self.board)  # Leaves the cached move a queen
+                    move.promotionChoice = codePromotions[promotion]
+                return move
+        return None
+
+    '''
+    Returns the position as a FEN string. The move number is worked out from the move log
+    '''
+    def get_fen(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for square in row:
+                if square == '--':
+                    empty += 1
+                else:
+                    if empty != 0:
+                        rank += str(empty)
+                        empty = 0
+                    rank += square[1].upper() if square[0] == 'w' else square[1].lower()
+            if empty != 0:
+                rank += str(empty)
+            ranks.append(rank)
+
+        castling = ''.join(letter for letter, allowed in (('K', self.whiteCanCastleKingSide), ('Q', self.whiteCanCastleQueenSide),
+                                                          ('k', self.blackCanCastleKingSide), ('q', self.blackCanCastleQueenSide)) if allowed)
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = '-'
+        return ' '.join(['/'.join(ranks), 'w' if self.whiteToMove else 'b', castling or '-', enpassant,
+                         str(self.halfmoveClock), str(len(self.moveLog) // 2 + 1)])
+
+    '''
+    Works out the hash of the position from scratch - make_move and undo_move keep it up to date after this
+    '''
+    def compute_hash(self):
+        hash_key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != '--':
+                    hash_key ^= zobristPieces[self.board[r][c]][r * 8 + c]
+        hash_key ^= zobristCastleRights[self.castle_rights_bits()] ^ zobristEnpassantFiles[self.enpassant_file()]
+        if not self.whiteToMove:
+            hash_key ^= zobristBlackToMove
+        return hash_key
+
+    def compute_phase(self):
+        return sum(phaseWeights[square[1]] for row in self.board for square in row if square != '--')
+
+    def compute_pawn_hash(self):
+        hash_key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c][1] == 'p':
+                    hash_key ^= zobristPieces[self.board[r][c]][r * 8 + c]
+        return hash_key
+
+    '''
+    Returns the numbers to XOR into the pawn hash for the move. A promoted pawn leaves the pawns altogether
+    '''
+    def pawn_hash_change(self, move):
+        change = 0
+        if move.pieceMoved[1] == 'p':
+            change ^= zobristPieces[move.pieceMoved][move.startRow * 8 + move.startCol]
+            if not move.isPawnPromotion:
+                change ^= zobristPieces[move.pieceMoved][move.endRow * 8 + move.endCol]
+        if move.pieceCaptured[1] == 'p':
+            captured_row = move.startRow if move.isEnpassantMove else move.endRow
+            change ^= zobristPieces[move.pieceCaptured][captured_row * 8 + move.endCol]
+        return change
+
     '''
     Will update the rights to castle based on the move
     '''
@@ -255,6 +556,18 @@ class GameState:
                 elif move.startCol == 7: #Right Rook
                     self.blackCanCastleKingSide = False
 
+        # A rook that is captured in its corner can't castle either
+        if move.pieceCaptured == 'wR' and move.endRow == 7:
+            if move.endCol == 0:
+                self.whiteCanCastleQueenSide = False
+            elif move.endCol == 7:
+                self.whiteCanCastleKingSide = False
+        elif move.pieceCaptured == 'bR' and move.endRow == 0:
+            if move.endCol == 0:
+                self.blackCanCastleQueenSide = False
+            elif move.endCol == 7:
+                self.blackCanCastleKingSide = False
+
     def square_under_attack(self, r, c, friendly):
         enemy_colour = 'w' if friendly == 'b' else 'b'
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
@@ -282,9 +595,9 @@ class GameState:
                             return True
                         else: # There are no impending checks by the enemy piece
                             break
-
-                    else:
-                        break
+                    # Empty squares don't block so the loop carries on
+                else:
+                    break
         # Check for Knight Checks
         directions = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2),
                     (1, 2), (2, -1), (2, 1))
@@ -300,10 +613,90 @@ class GameState:
                     return True
 
         return False
+
+    '''
+    Returns the square of the least valuable piece of the colour that attacks the square, or None.
+    Pins are ignored, and pieces taken off the board by static_exchange_evaluation let the pieces behind them through
+    '''
+    def least_valuable_attacker(self, r, c, colour):
+        pawn_row = r + 1 if colour == 'w' else r - 1  # White pawns attack upwards, black pawns downwards
+        if 0 <= pawn_row < 8:
+            for end_col in (c - 1, c + 1):
+                if 0 <= end_col < 8 and self.board[pawn_row][end_col] == colour + 'p':
+                    return pawn_row, end_col
+
+        for m in ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)):
+            end_row = r + m[0]
+            end_col = c + m[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and self.board[end_row][end_col] == colour + 'N':
+                return end_row, end_col
+
+        # The first piece along each line, the rooks' lines first and then the bishops'
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        first_pieces = []
+        for j in range(len(directions)):
+            d = directions[j]
+            for i in range(1, 8):
+                end_row = r + d[0] * i
+                end_col = c + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                if self.board[end_row][end_col] != '--':
+                    if self.board[end_row][end_col][0] == colour:
+                        first_pieces.append((self.board[end_row][end_col][1], j, i, end_row, end_col))
+                    break
+
+        for piece, lines in (('B', range(4, 8)), ('R', range(0, 4)), ('Q', range(0, 8))):
+            for first_piece, j, i, end_row, end_col in first_pieces:
+                if first_piece == piece and j in lines:
+                    return end_row, end_col
+
+        for first_piece, j, i, end_row, end_col in first_pieces:
+            if first_piece == 'K' and i == 1:
+                return end_row, end_col
+        return None
+
+    '''
+    Static exchange evaluation - the material the player making the capture wins (in exchangeValues) if both players
+    keep capturing on the end square with their least valuable piece for as long as it is worth it.
+    Negative means the capture loses material
+    '''
+    def static_exchange_evaluation(self, move):
+        r, c = move.endRow, move.endCol
+        gains = [exchangeValues[move.pieceCaptured[1]] if move.pieceCaptured != '--' else 0]
+        piece_on_square = move.promotionChoice if move.isPawnPromotion else move.pieceMoved[1]
+        if move.isPawnPromotion:
+            gains[0] += exchangeValues[move.promotionChoice] - exchangeValues['p']
+
+        # The pieces are taken off the board as they capture so that the pieces behind them can join in
+        removed = [(move.startRow, move.startCol, move.pieceMoved)]
+        if move.isEnpassantMove:
+            removed.append((move.startRow, move.endCol, move.pieceCaptured))
+        for row, col, piece in removed:
+            self.board[row][col] = '--'
+
+        colour = 'b' if move.pieceMoved[0] == 'w' else 'w'
+        while True:
+            attacker = self.least_valuable_attacker(r, c, colour)
+            if attacker is None:
+                break
+            gains.append(exchangeValues[piece_on_square] - gains[-1])  # What this capture wins for the other player
+            piece_on_square = self.board[attacker[0]][attacker[1]][1]
+            removed.append((attacker[0], attacker[1], self.board[attacker[0]][attacker[1]]))
+            self.board[attacker[0]][attacker[1]] = '--'
+            colour = 'b' if colour == 'w' else 'w'
+
+        for row, col, piece in removed:
+            self.board[row][col] = piece
+
+        # Working back from the last capture, each player only captures if it is better than stopping
+        for i in range(len(gains) - 1, 0, -1):
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
+
     def check_for_pins_and_checks(self):
         pins = []
         checks = []
-        self.pins = []
         in_check = False
         if self.whiteToMove:
             enemy_colour = 'b'
@@ -327,7 +720,11 @@ class GameState:
                 end_col = start_col + d[1] * i
                 if 0 <= end_row < 8 and 0 <= end_col < 8:
                     end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == friendly and end_piece[1] != 'K':
+                    if end_piece == '--' or end_piece == friendly + 'K':
+                        # Empty squares don't block, and neither does the king's own square when king() is
+                        # testing one of its moves, as the king will have moved off it
+                        continue
+                    if end_piece[0] == friendly:
                         # removes the possibility of the king being able to move in the same direction away from enemy piece whilst still being in check.
                         if possible_pin == ():  # the first friendly piece could be pinned
                             possible_pin = (end_row, end_col, d[0], d[1])
@@ -351,12 +748,11 @@ class GameState:
                             if possible_pin == ():  # if there are no pins, there must be a check
                                 in_check = True
                                 checks.append((end_row, end_col, d[0], d[1]))
+                            else:  # There is a piece blocking so there must be a pin
+                                pins.append(possible_pin)
                             break
-                        else:  # There is a piece blocking so there must be a pin
-                            pins.append(possible_pin)
+                        else:  # There are no impending checks by the enemy piece
                             break
-                    else:  # There are no impending checks by the enemy piece
-                        break
                 else:
                     break
         # Check for Knight Checks
@@ -404,89 +800,51 @@ class GameState:
         if self.whiteToMove:
             move_amount = -1
             start_row = 6
-            king_row, king_col = self.WhiteKingPosition
             enemy_colour = 'b'
 
         else:
             move_amount = 1
             start_row = 1
-            king_row, king_col = self.BlackKingPosition
             enemy_colour = 'w'
 
         # Moving
         if self.board[r + move_amount][c] == '--': # 1 square pawn move
-            if pin_direction == (move_amount, 0) or not piece_pinned:
+            # A pinned pawn can still move along the pin, towards the king or away from it
+            if pin_direction in ((move_amount, 0), (-move_amount, 0)) or not piece_pinned:
                 moves.append(Move((r, c), (r + move_amount, c), self.board))
 
-        if r == start_row and self.board[r + 2 * move_amount][c] == '--': # 2 square pawn move
-            moves.append(Move((r, c), (r + 2 * move_amount, c), self.board))
-
-        # Capturing
-        if c - 1 >= 0 and (pin_direction == (move_amount, -1) or not piece_pinned):
-            if pin_direction == (move_amount, -1):
-                if self.board[r + move_amount][c - 1][0] == enemy_colour:
-                    # Diagonal Left Capture
-                    moves.append(Move((r, c), (r + move_amount, c - 1), self.board))
-
-            if (r + move_amount, c - 1) == self.enpassantPossible:
-                moves.append(Move((r, c), (r + move_amount, c - 1), self.board, is_enpassant_move=True))
-                is_attacking_piece = is_blocking_piece = False
-                if king_row == r:
-                    if king_col < c: # Checks if the king is left of the pawn
-                        inside_range = range(king_col + 1, c - 1)
-                        outside_range = range(c + 1, 8) # gives the list of values between pawn and end of the board
-                    else: # King is to the right of the pawn
-                        inside_range = range(king_col - 1, c + 1, -1)
-                        outside_range = range(c - 1, -1, -1)
-
-                    for i in inside_range:
-                        if self.board[r][i] != '--':  # There is a piece blocking
-                            is_blocking_piece = True
-
-                    for i in outside_range:
-                        square = self.board[r][i]
-                        if square[0] == enemy_colour and (
-                                square[1] == 'R' or square[1] == 'Q'):  # There is an attacking piece
-                            is_attacking_piece = True
-                        elif square != '--':
-                            is_blocking_piece = True
-                    if not is_attacking_piece or is_blocking_piece:
-                        moves.append(Move((r, c), (r + move_amount, c - 1), self.board))
-
-                    # Right Diagonal Capture
-                    if c + 1 <= 7:  # Ensure right capture is within bounds
-                        if not piece_pinned or pin_direction == (
-                        move_amount, 1):  # Ensure it's not pinned or matches the pin direction
-                            # Check if the square to the right has an enemy piece
-                            if self.board[r + move_amount][c + 1][
-                                0] == enemy_colour:  # Ensure enemy piece in the diagonal
-                                moves.append(
-                                    Move((r, c), (r + move_amount, c + 1), self.board))  # Diagonal Right Capture
-                            if (r + move_amount, c + 1) == self.enpassantPossible:
-                                is_attacking_piece = is_blocking_piece = False
-                    if king_row == r:
-                        if king_col < c:  # Checks if the king is left of the pawn
-                            # inside range is between the king and pawn, outside range is between the pawn and the end of the board
-                            inside_range = range(king_col + 1, c)  # gives the list of values between king and pawn
-                            outside_range = range(c + 2, 8)  # give list of values between pawn and end of the board
-                        else:  # King is to the right of the pawn
-                            inside_range = range(king_col - 1, c + 1, -1)
-                            outside_range = range(c - 1, -1, -1)
-
-                    for i in inside_range:
-                        if self.board[r][i] != '--':  # There is a piece blocking
-                            is_blocking_piece = True
-
-                    for i in outside_range:
-                        square = self.board[r][i]
-                        if square[0] == enemy_colour and (
-                                square[1] == 'R' or square[1] == 'Q'):  # There is an attacking piece
-                            is_attacking_piece = True
-                        elif square[0] == enemy_colour and (
-                                square[1] == 'R' or square[1] == 'Q'):  # There is an attacking piece
-                            is_attacking_piece = True
-                    if not is_attacking_piece or is_blocking_piece:
-                        moves.append(Move((r, c), (r + move_amount, c + 1), self.board, is_enpassant_move=True))
+                if r == start_row and self.board[r + 2 * move_amount][c] == '--': # 2 square pawn move
+                    moves.append(Move((r, c), (r + 2 * move_amount, c), self.board))
+
+        # Capturing - left diagonal then right diagonal
+        for col_change in (-1, 1):
+            end_row = r + move_amount
+            end_col = c + col_change
+            if 0 <= end_col < 8 and (pin_direction in ((move_amount, col_change), (-move_amount, -col_change)) or not piece_pinned):
+                if self.board[end_row][end_col][0] == enemy_colour:
+                    moves.append(Move((r, c), (end_row, end_col), self.board))
+                elif (end_row, end_col) == self.enpassantPossible and self.is_enpassant_safe(r, c, end_row, end_col):
+                    moves.append(Move((r, c), (end_row, end_col), self.board, is_enpassant_move=True))
+
+    '''
+    En passant takes two pawns off the same row at once, which can leave the king in check in ways the pins
+    don't cover, so the capture is made on the board for a moment to see if the king would be attacked
+    '''
+    def is_enpassant_safe(self, r, c, end_row, end_col):
+        friendly = self.board[r][c][0]
+        captured_pawn = self.board[r][end_col]
+        self.board[r][c] = '--'
+        self.board[r][end_col] = '--'
+        self.board[end_row][end_col] = friendly + 'p'
+
+        king_row, king_col = self.WhiteKingPosition if friendly == 'w' else self.BlackKingPosition
+        safe = not self.square_under_attack(king_row, king_col, friendly)
+
+        self.board[end_row][end_col] = '--'
+        self.board[r][end_col] = captured_pawn
+        self.board[r][c] = friendly + 'p'
+        return safe
+
     '''
     Gets all the Rooks moves and adds these moves to the list
     '''
@@ -522,13 +880,12 @@ class GameState:
                     if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]): #Checks if the pin is in the direction or the opposite direction as well
 
                         end_square = self.board[end_row][end_col]
-                        if end_square[0] == enemy_colour: #Checks if the first index of the piece in the underlying text based game is the enemy colour
+                        if end_square == '--': #checks if the squares in the given direction is empty
                             moves.append(Move((r,c), (end_row, end_col), self.board))
-                        elif end_square == '--': #checks if the squares in the given direction is empty
+                        elif end_square[0] == enemy_colour: #Checks if the first index of the piece in the underlying text based game is the enemy colour
                             moves.append(Move((r,c), (end_row, end_col), self.board))
-
-                            break
-                        else: #when the end_square is not on the board
+                            break  # Can't move past a piece it captures
+                        else: #when the end_square has a friendly piece
 
                             break
                     else:
@@ -567,7 +924,8 @@ class GameState:
             if self.pins[i][0] == r and self.pins[i][1] == c:
                 piece_pinned = True
                 pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
+                if self.board[r][c][1] != 'Q':  # The queen's pin is still needed when rook() is called for it
+                    self.pins.remove(self.pins[i])
                 break
 
         directions = ((-1, -1), (1,-1), (-1, 1), (1, 1))
@@ -584,13 +942,12 @@ class GameState:
                     if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
 
                         end_square = self.board[end_row][end_col]
-                        if end_square[0] == enemy_colour: # Checks if the first index of the piece in the underlying text based game is the enemy colour
+                        if end_square == '--': # checks if the squares in the given direction is empty
                             moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif end_square == '--': # checks if the squares in the given direction is empty
+                        elif end_square[0] == enemy_colour: # Checks if the first index of the piece in the underlying text based game is the enemy colour
                             moves.append(Move((r, c), (end_row, end_col), self.board))
-
-                            break
-                        else: # when the end_square is off the board
+                            break  # Can't move past a piece it captures
+                        else: # when the end_square has a friendly piece
                             break
                     else:
                         break
@@ -627,8 +984,6 @@ class GameState:
                         self.WhiteKingPosition = (r, c)
                     else:
                         self.BlackKingPosition = (r, c)
-                    if in_check:
-                        return
 
         self.get_castle_moves(r, c, moves, friendly)
     '''
@@ -669,20 +1024,63 @@ class GameState:
 
 
 
-class CastleRights:
-   def __init__(self, wks, bks, wqs, bqs):
-       self.wks = wks
-       self.bks = bks
-       self.wqs = wqs
-       self.bqs = bqs
-
+'''
+A least recently used cache of valid moves by position hash. When it is full the position that was used
+longest ago is forgotten. Keeps count of its hits and misses so that the hit rate can be checked
+'''
+class MoveCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hash_key):
+        entry = self.entries.get(hash_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(hash_key)  # Now the most recently used
+        self.hits += 1
+        return entry
+
+    def put(self, hash_key, entry):
+        self.entries[hash_key] = entry
+        self.entries.move_to_end(hash_key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)  # Forgets the least recently used position
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_rate(self):
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits / (self.hits + self.misses)
+
+
+'''
+Indexes a list of legal moves by their start square and by their start and end squares, so that finding the move
+the user clicked or the moves of the selected piece doesn't need to look through the whole list
+'''
+class MoveIndex:
+    def __init__(self, moves):
+        self.moves = moves
+        self.movesFromSquare = {}  # (row, col) -> list of moves starting on that square
+        self.movesBySquares = {}  # ((start row, start col), (end row, end col)) -> move
+        for move in moves:
+            start_sq = (move.startRow, move.startCol)
+            end_sq = (move.endRow, move.endCol)
+            self.movesFromSquare.setdefault(start_sq, []).append(move)
+            if (start_sq, end_sq) not in self.movesBySquares:  # Keeps the first move if two have the same squares
+                self.movesBySquares[(start_sq, end_sq)] = move
+
+    def find_move(self, start_sq, end_sq):
+        return self.movesBySquares.get((start_sq, end_sq))  # None if the move isn't legal
+
+    def moves_from(self, start_sq):
+        return self.movesFromSquare.get(start_sq, [])
 
-class CastleRights:
-    def __init__(self, white_king_side, black_king_side, white_queen_side, black_queen_side):
-        self.whiteKingSide = white_king_side
-        self.blackKingSide = black_king_side
-        self.whiteQueenSide = white_queen_side
-        self.blackQueenSide = black_queen_side
 
 class Move:
     # Creating a dictionary that will translate the computer notation of
@@ -712,6 +1110,7 @@ class Move:
         if (self.pieceMoved == 'wp' and self.endRow == 0) or (
                 self.pieceMoved == 'bp' and self.endRow == 7):  # These are the criteria for pawn promotion
             self.isPawnPromotion = True
+        self.promotionChoice = 'Q'  # 'Q', 'R', 'B' or 'N' - ChessMain changes this when the user picks a different piece
 
         # En passant
         self.isEnpassantMove = is_enpassant_move
@@ -734,6 +1133,18 @@ class Move:
     def get_move_in_chess_notation(self):
         return self.get_rank_file(self.startRow, self.startCol) + self.get_rank_file(self.endRow, self.endCol)
 
+    # UCI notation also has the promotion piece, e.g. 'e7e8q'
+    def get_move_in_uci_notation(self):
+        return self.get_move_in_chess_notation() + (self.promotionChoice.lower() if self.isPawnPromotion else '')
+
+    '''
+    Packs the move into 16 bits for the opening book and game archive files - the start square in bits 0-5,
+    the end square in bits 6-11 and the promotion piece in bits 12-14
+    '''
+    def get_move_code(self):
+        promotion = promotionCodes[self.promotionChoice] if self.isPawnPromotion else 0
+        return (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6 | promotion << 12
+
     def get_rank_file(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
@@ -3,38 +3,65 @@ This is the main file. It is responsible for handling user input and
 displaying the current Game State
 """
 
-import pygame as pg
-import ChessEngine, ChessAI
-# ChessMain.py
-
-import board
-import pieces
-import ai
-from move import Move
-
-
-game_board = board.Board.new()
-
-print(game_board.to_string())
-
-user_move = Move(0, 1, 0, 3)
-game_board.perform_move(user_move)
-
-print(game_board.to_string())
-
-ai_move = ai.AI.get_ai_move(game_board, [])
-game_board.perform_move(ai_move)
+import copy
+import sys
 
-print(game_board.to_string())
+import pygame as pg
+import ChessEngine, ChessAI, ChessProfiler, ChessClient, ChessReview
 
 screenWidth = screenHeight = 512  # Setting up the size of the screen
 moveHistoryPanelWidth = 350
 moveHistoryPanelHeight = screenHeight
 boardSize = 8  # Chess Boards are 8x8
 squareSize = screenHeight // boardSize  # Creating the dimensions of each square as fraction of the screen size
-maxFrameRate = 20  # For animations
+maxFrameRate = 20  # For the main loop
+animationFrameRate = 60  # Animations are only this smooth while they are running
+secondsPerSquare = 1 / 6  # How long an animated piece takes to move one square
 Images = {}  # only want to load images once
 animate = False  # Should only animate when a move is being made not when it is being undone
+profileAISearch = False  # Prints a per-function call count and time report after every AI search
+aiServerAddress = None  # ('127.0.0.1', 8765) or a Unix socket path to have a ChessServer do the AI searches instead
+aiTimeLimit = 30.0  # Seconds the server gets for each AI move
+aiProfileName = 'club'  # How strongly the AI plays - one of the names in ChessAI.engineProfiles
+reviewProfileName = ChessReview.reviewProfileName  # How deeply a finished game is searched when it is reviewed
+reviewWorkers = None  # Engine processes for the review, None for one per CPU
+
+# Render cache - only the squares that look different to the last frame get drawn again
+boardBackground = None  # All 64 squares drawn once onto their own surface
+highlightSurfaces = {}  # The transparent squares used to highlight the selected piece and its moves
+highlightedSquaresCache = (None, (), {})  # (move index, selected square, highlights) from the last time they were worked out
+renderedSquares = [[None] * boardSize for row in range(boardSize)]  # (piece, highlight) shown on each square last frame
+renderedMoveLogLength = -1  # Length of the move log when the move history panel was last drawn
+
+# Move history cache - each line of the panel is only rendered again when one of its moves changes
+moveHistoryMoves = []  # The moves the cached lines were made from
+moveHistoryStrings = []  # str() of each of those moves
+moveHistoryLines = []  # Rendered text surface for each line of the panel
+moveHistoryScroll = 0  # How many lines the panel is scrolled up from the newest move
+movesPerLine = 3
+boardRectangle = pg.Rect(0, 0, screenWidth, screenHeight)
+
+'''
+Finds the legal move with the UCI notation from the server, e.g. 'e7e8n'
+'''
+def find_move_by_uci(move_index, uci):
+    start_sq = (ChessEngine.Move.ranksToRows[uci[1]], ChessEngine.Move.filesToCols[uci[0]])
+    end_sq = (ChessEngine.Move.ranksToRows[uci[3]], ChessEngine.Move.filesToCols[uci[2]])
+    move = move_index.find_move(start_sq, end_sq)
+    if move is not None and move.isPawnPromotion and len(uci) > 4:
+        move = copy.copy(move)  # The move cache keeps the original, which has to stay a queen promotion
+        move.promotionChoice = uci[4].upper()
+    return move
+
+'''
+Called when the server can't be reached any more. The AI searches in this process from then on, so the game
+carries on. Returns None for the client
+'''
+def drop_server(client, error):
+    print('Lost the connection to the AI server, the AI will search here instead: ' + str(error))
+    if client is not None:
+        client.close()
+    return None
 
 '''
 I am going to load each image once in the main file.
@@ -44,6 +71,11 @@ def load_piece_images():
     pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN','bB', 'bK', 'bQ']
     for piece in pieces:
         Images[piece] = pg.transform.scale(pg.image.load("images/" + piece + ".png"), (squareSize, squareSize))
+    for highlight, colour in (('selected', 'blue'), ('move', 'red')):
+        s = pg.Surface((squareSize, squareSize))
+        s.set_alpha(100)  # sets the transparency between 1 and 255
+        s.fill(pg.Color(colour))
+        highlightSurfaces[highlight] = s
 
 # Now I can access any image by just typing Images['pieceName']
 
@@ -61,17 +93,32 @@ def main():
     clock = pg.time.Clock()  # controls the frame rate
     screen.fill(pg.Color('White'))
     moveLogFont = pg.font.SysFont('Arial', 18)  # Changed from Font to SysFont
+    if profileAISearch:
+        ChessProfiler.enable()
     gs = ChessEngine.GameState()
     load_piece_images()  # will only load the images once
 
+    # With a server the game is kept on the server too, and the AI searches there while the screen carries on
+    client = None
+    gameId = None
+    pendingAIMove = None  # The server's answer to the AI move request, once it has been sent
+    if aiServerAddress is not None:
+        try:
+            client = ChessClient.ChessClient(aiServerAddress)
+            gameId = client.new_game()['game']
+        except (OSError, ChessClient.ServerError) as error:
+            client = drop_server(client, error)
+
     # Game state variables
     isGameRunning = True
     sqSelected = ()  # use of a tuple (row,col) here instead of having to reference the x and y coordinates
     playerMoveClicks = []  # Keeps tracks of the player clicks consisting of two tuples [(3,2), (5,5)]
     legalMoves = gs.get_valid_moves()
+    legalMoveIndex = ChessEngine.MoveIndex(legalMoves)  # Made once per position so clicks and highlights can look moves up
     print(legalMoves)
     isMoveMade = False  # A new set of valid moves will only be generated if a valid move is made in the first place
     isGameOver = False
+    reviewJob = None  # The review of the finished game while its positions are being searched
 
     isPlayerWhite  = True  # If a human is playing white then it is True, if an AI is playing then this is False
     isPlayerBlack = False  # Same as above but for black
@@ -83,7 +130,11 @@ def main():
             if event.type == pg.QUIT:
                 isGameRunning = False
 
-            elif event.type == pg.MOUSEBUTTONDOWN:
+            elif event.type == pg.MOUSEWHEEL:
+                if pg.mouse.get_pos()[0] >= screenWidth:  # Only scrolls when the mouse is over the move log
+                    scroll_move_history(event.y)
+
+            elif event.type == pg.MOUSEBUTTONDOWN and event.button not in (4, 5):  # Buttons 4 and 5 are the scroll wheel
                 if not isGameOver and is_human_turn:  # only allow mouse clicks if the game has not finished and, it's the human's turn
                     location = pg.mouse.get_pos()  # This gets the x and y coordinates of the mouse
                     col = location[0] // squareSize  # columns are the x coordinates
@@ -98,24 +149,46 @@ def main():
                         print(playerMoveClicks)
 
                     if len(playerMoveClicks) == 2:  # Checks for if the second click has been made
-                        move = ChessEngine.Move(playerMoveClicks[0], playerMoveClicks[1], gs.board)
-                        print(move.get_move_in_chess_notation())
-                        for i in range(len(legalMoves)):
-                            if move == legalMoves[i]:
-                                gs.make_move(legalMoves[i])
-                                # The only moves able to be made are the moves generated by the engine
-                                isMoveMade = True
-                                animate = True
-                                sqSelected = ()  # Resets the user clicks so the user can make another move
-                                playerMoveClicks = []
-                                break
+                        move = legalMoveIndex.find_move(playerMoveClicks[0], playerMoveClicks[1])
+                        if move is not None:
+                            print(move.get_move_in_chess_notation())
+                            if move.isPawnPromotion:
+                                move = copy.copy(move)  # The move cache keeps the original, which has to stay a queen promotion
+                                move.promotionChoice = choose_promotion_piece()
+                            gs.make_move(move)
+                            if client is not None:
+                                try:
+                                    client.make_move(gameId, move.get_move_in_uci_notation())
+                                except ChessClient.ServerError as error:
+                                    client = drop_server(client, error)
+                            # The only moves able to be made are the moves generated by the engine
+                            isMoveMade = True
+                            animate = True
+                            sqSelected = ()  # Resets the user clicks so the user can make another move
+                            playerMoveClicks = []
 
                         if not isMoveMade:
                             playerMoveClicks = [sqSelected]
 
             elif event.type == pg.KEYDOWN:
+                if event.key == pg.K_v and isGameOver and reviewJob is None and len(gs.moveLog) != 0:
+                    # Reviews the finished game when v is pressed, the report is printed once it is ready
+                    print('Reviewing the game...')
+                    reviewJob = ChessReview.ReviewJob(gs, reviewProfileName, reviewWorkers)
+
+                if event.key in (pg.K_z, pg.K_r) and reviewJob is not None:  # The game being reviewed has changed
+                    reviewJob.cancel()
+                    reviewJob = None
+
                 if event.key == pg.K_z:  # Undoes the move when z is pressed
+                    if client is not None and len(gs.moveLog) != 0:
+                        try:
+                            client.undo_move(gameId)
+                        except ChessClient.ServerError as error:
+                            client = drop_server(client, error)
+                    pendingAIMove = None  # The search was for the position before the undo
                     gs.undo_move()
+                    invalidate_render_cache()  # Gets rid of the game over message if there was one
                     sqSelected = ()
                     playerMoveClicks = []
                     isMoveMade = True
@@ -124,7 +197,16 @@ def main():
 
                 if event.key == pg.K_r:  # Resets the board when r is pressed
                     gs = ChessEngine.GameState()
+                    if client is not None:
+                        try:
+                            client.close_game(gameId)
+                            gameId = client.new_game()['game']
+                        except ChessClient.ServerError as error:
+                            client = drop_server(client, error)
+                    pendingAIMove = None
                     legalMoves = gs.get_valid_moves()
+                    legalMoveIndex = ChessEngine.MoveIndex(legalMoves)
+                    invalidate_render_cache()
                     sqSelected = ()
                     playerMoveClicks = []
                     isMoveMade = False
@@ -133,150 +215,272 @@ def main():
 
         # AI move logic (moved inside main game loop)
         if not isGameOver and not is_human_turn:
-            AIMove = ChessAI.get_best_move(gs,legalMoves)
-            if AIMove is None:
-                AIMove = ChessAI.choose_random_move(legalMoves)
-            gs.make_move(AIMove)
-            isMoveMade = True
-            animate = True
+            AIMove = None
+            if client is None:
+                AIMove = ChessAI.get_best_move(gs, legalMoves, ChessProfiler.report_after_search(sys.stdout) if profileAISearch else None,
+                                               aiProfileName)
+                if AIMove is None:
+                    AIMove = ChessAI.choose_random_move(legalMoves)
+            elif pendingAIMove is None:
+                # The server only picks the move, it is made there below like the human's moves
+                try:
+                    pendingAIMove = client.submit_ai_move(gameId, aiTimeLimit, apply=False, profile=aiProfileName)
+                except ChessClient.ServerError as error:
+                    client = drop_server(client, error)  # The search happens here next frame
+            elif pendingAIMove.done():
+                try:
+                    AIMove = find_move_by_uci(legalMoveIndex, pendingAIMove.result()['move'])
+                except ChessClient.ServerError as error:  # e.g. the search was over the time limit
+                    print(error)
+                pendingAIMove = None
+                if client.closed:  # Without an answer the move is searched here next frame rather than played at random
+                    client = drop_server(client, 'the server closed the connection')
+                else:
+                    if AIMove is None:
+                        AIMove = ChessAI.choose_random_move(legalMoves)
+                    try:
+                        client.make_move(gameId, AIMove.get_move_in_uci_notation())
+                    except ChessClient.ServerError as error:
+                        client = drop_server(client, error)
+            if AIMove is not None:
+                gs.make_move(AIMove)
+                isMoveMade = True
+                animate = True
+
+        if reviewJob is not None and reviewJob.done():
+            try:
+                for line in reviewJob.result().get_report():
+                    print(line)
+            except Exception as error:  # e.g. an engine process died, the game carries on without the review
+                print('The review failed: ' + type(error).__name__ + ': ' + str(error))
+            reviewJob = None
 
         if isMoveMade:
             if animate:
                 animate_piece_move(gs.moveLog[-1], screen, gs.board, clock)
+                invalidate_render_cache()  # The animation draws straight onto the screen
             legalMoves = gs.get_valid_moves()
+            legalMoveIndex = ChessEngine.MoveIndex(legalMoves)
             isMoveMade = False
             animate = False
 
-        render_game_state(screen, gs, legalMoves, sqSelected, moveLogFont)
+        dirty_rects = render_game_state(screen, gs, legalMoveIndex, sqSelected, moveLogFont)
 
-        if gs.checkmate or gs.stalemate:
+        if gs.checkmate or gs.stalemate or gs.is_draw_by_repetition() or gs.is_draw_by_fifty_move_rule():
+            message_needed = dirty_rects or not isGameOver  # Only drawn again if it has been drawn over
             isGameOver = True
-            if gs.stalemate:
-                text = 'Stalemate!'
-            else:
+            if gs.checkmate:  # Checkmate counts even if the move also made a draw
                 if gs.whiteToMove:
                     text = 'Black Wins by Checkmate!'
                 else:
                     text = 'White Wins by Checkmate!'
-            display_game_over_message(screen, text)
+            elif gs.stalemate:
+                text = 'Stalemate!'
+            elif gs.is_draw_by_repetition():
+                text = 'Draw by Repetition!'
+            else:
+                text = 'Draw by the 50 Move Rule!'
+            if message_needed:
+                display_game_over_message(screen, text)
+                dirty_rects.append(boardRectangle)
 
         clock.tick(maxFrameRate)
-        pg.display.flip()  # Updates the display
+        pg.display.update(dirty_rects)  # Only updates the parts of the display that changed
 
-def render_game_state(screen_1, gs_1, valid_moves, sq_selected, move_log_font):
-    draw_chessboard(screen_1)  # draws the squares on the board
-    highlight_valid_moves(screen_1, gs_1, valid_moves, sq_selected)
-    render_pieces(screen_1, gs_1.board)  # draws pieces on top of the board
-    render_move_history(screen_1, gs_1, move_log_font)
+    if reviewJob is not None:
+        reviewJob.cancel()
+    if client is not None:
+        client.close()  # The server closes the game when the connection goes
 
 '''
-Draws the squares on the board
+Draws only the squares that have changed since the last frame and the move log if a move has been made or undone.
+Returns the rectangles that were drawn on so that only they get updated on the display
 '''
-def draw_chessboard(screen_1):
-    colours = [pg.Color("white"), pg.Color("#BEE5B0")]
+def render_game_state(screen_1, gs_1, move_index, sq_selected, move_log_font):
+    global renderedMoveLogLength
+    dirty_rects = []
+    highlights = get_highlighted_squares(gs_1, move_index, sq_selected)
     for r in range(boardSize):
         for c in range(boardSize):
-            colour = colours[((r + c) % 2)]
-            pg.draw.rect(screen_1, colour, pg.Rect(c * squareSize, r * squareSize, squareSize, squareSize))
+            square = (gs_1.board[r][c], highlights.get((r, c)))
+            if renderedSquares[r][c] != square:
+                renderedSquares[r][c] = square
+                dirty_rects.append(draw_square(screen_1, r, c, square[0], square[1]))
+
+    if renderedMoveLogLength != len(gs_1.moveLog):
+        renderedMoveLogLength = len(gs_1.moveLog)
+        dirty_rects.append(render_move_history(screen_1, gs_1, move_log_font))
+    return dirty_rects
 
 '''
-Move highlighting - Highlights the piece selected and its possible moves
+Forgets what is on the screen so that everything is drawn again on the next frame
 '''
-def highlight_valid_moves(screen_1, gs_1, valid_moves, sq_selected):  # Added sq_selected parameter
+def invalidate_render_cache():
+    global renderedMoveLogLength
+    for row in renderedSquares:
+        for c in range(boardSize):
+            row[c] = None
+    renderedMoveLogLength = -1
+
+'''
+Draws one square from the cached board, then its highlight and piece on top
+'''
+def draw_square(screen_1, r, c, piece, highlight):
+    square = pg.Rect(c * squareSize, r * squareSize, squareSize, squareSize)
+    screen_1.blit(get_board_background(), square, square)
+    if highlight is not None:
+        screen_1.blit(highlightSurfaces[highlight], square)
+    if piece != '--':
+        screen_1.blit(Images[piece], square)
+    return square
+
+'''
+Draws the squares of the board onto a surface the first time it is needed, after that the same surface is used
+'''
+def get_board_background():
+    global boardBackground
+    if boardBackground is None:
+        boardBackground = pg.Surface((screenWidth, screenHeight))
+        colours = [pg.Color("white"), pg.Color("#BEE5B0")]
+        for r in range(boardSize):
+            for c in range(boardSize):
+                colour = colours[((r + c) % 2)]
+                pg.draw.rect(boardBackground, colour, pg.Rect(c * squareSize, r * squareSize, squareSize, squareSize))
+    return boardBackground
+
+'''
+Move highlighting - Finds the piece selected and its possible moves so that they can be highlighted.
+They are only worked out again when the selected square or the position changes
+'''
+def get_highlighted_squares(gs_1, move_index, sq_selected):
+    global highlightedSquaresCache
+    cached_index, cached_square, highlights = highlightedSquaresCache
+    if cached_index is move_index and cached_square == sq_selected:
+        return highlights
+
+    highlights = {}
     if sq_selected != ():  # Makes sure the user hasn't clicked on an end square yet
         r, c = sq_selected
         if gs_1.board[r][c][0] == ('w' if gs_1.whiteToMove else 'b'):
             # Makes sure that the square selected is a piece that can be moved
-            # Highlighting the selected square
-            s = pg.Surface((squareSize, squareSize))
-            s.set_alpha(100)  # sets the transparency between 1 and 255
-            s.fill(pg.Color('blue'))
-            screen_1.blit(s, (c * squareSize, r * squareSize))
-
-            # Highlighting possible moves
-            s.fill(pg.Color('red'))
-            for move_1 in valid_moves:  # Changed from validMoves to valid_moves
-                if move_1.startRow == r and move_1.startCol == c:
-                    # Checks if the move starts from the selected square
-                    screen_1.blit(s, (move_1.endCol * squareSize, move_1.endRow * squareSize))
-
-'''
-Draws the pieces on the board
-'''
-def render_pieces(screen_1, board):
-    for r in range(boardSize):
-        for c in range(boardSize):
-            piece = board[r][c]
-            if piece != '--':
-                screen_1.blit(Images[piece], pg.Rect(c * squareSize, r * squareSize, squareSize, squareSize))
+            highlights[(r, c)] = 'selected'
+            for move_1 in move_index.moves_from(sq_selected):
+                highlights[(move_1.endRow, move_1.endCol)] = 'move'
+    highlightedSquaresCache = (move_index, sq_selected, highlights)
+    return highlights
 
 '''
 Draws the move log on the screen
 '''
 def render_move_history(screen_1, gs_1, font):
+    global moveHistoryScroll
     move_log_rectangle = pg.Rect(screenWidth, 0, moveHistoryPanelWidth, moveHistoryPanelHeight)
     pg.draw.rect(screen_1, pg.Color('black'), move_log_rectangle)  # Colour of rectangle
+    update_move_history_lines(gs_1.moveLog, font)
 
-    move_log = gs_1.moveLog
-    move_texts = []
-    for i in range(0, len(move_log), 2):  # Changed x to i
-        move_string = str(i // 2 + 1) + '.' + str(move_log[i]) + ' '
-        # Makes sure each move is under the same turn (move 1 and 2 is turn 1) (move 5 and 6 is turn 3)
-        if i + 1 < len(move_log):  # Makes sure black made a move
-            move_string += str(move_log[i + 1]) + ' '
-        move_texts.append(move_string)
-
-    moves_per_row = 3
     shift = 5
     texty = shift
     line_space = 2
-    for i in range(0, len(move_texts), moves_per_row):  # Changed x to i
-        # Makes sure multiple moves appear on the same line before going to the next line
-        text_1 = ''
-        for j in range(moves_per_row):
-            if i + j < len(move_texts):
-                text_1 += move_texts[i + j]
-        text_object = font.render(text_1, True, pg.Color('White'))  # Colour of text
+    line_height = font.get_linesize() + line_space
+    visible_lines = (moveHistoryPanelHeight - shift) // line_height
+    # Can't scroll further than the first line
+    moveHistoryScroll = max(0, min(moveHistoryScroll, len(moveHistoryLines) - visible_lines))
+    first_line = max(0, len(moveHistoryLines) - visible_lines - moveHistoryScroll)
+    for text_object in moveHistoryLines[first_line:first_line + visible_lines]:
         text_location = move_log_rectangle.move(shift, texty)
         screen_1.blit(text_object, text_location)  # Changed screen to screen_1
-        texty += text_object.get_height() + line_space
+        texty += line_height
+    return move_log_rectangle
 
+'''
+Brings the cached lines up to date with the move log. A new move only renders the last line again and
+an undo only renders the lines from the undone move onwards, so long games cost the same as short ones
+'''
+def update_move_history_lines(move_log, font):
+    # Finds how many of the cached moves are still in the move log - normally all of them or all but the last one
+    kept = min(len(moveHistoryMoves), len(move_log))
+    while kept > 0 and moveHistoryMoves[kept - 1] is not move_log[kept - 1]:
+        kept -= 1
+    if kept == len(moveHistoryMoves) == len(move_log):
+        return
+
+    del moveHistoryMoves[kept:]
+    del moveHistoryStrings[kept:]
+    for move in move_log[kept:]:
+        moveHistoryMoves.append(move)
+        moveHistoryStrings.append(str(move))
+
+    # Makes sure multiple moves appear on the same line before going to the next line (two moves in each turn)
+    first_changed_line = kept // (2 * movesPerLine)
+    del moveHistoryLines[first_changed_line:]
+    for line in range(first_changed_line, (len(moveHistoryStrings) + 2 * movesPerLine - 1) // (2 * movesPerLine)):
+        text_1 = ''
+        for turn in range(line * movesPerLine, (line + 1) * movesPerLine):
+            if 2 * turn < len(moveHistoryStrings):
+                text_1 += str(turn + 1) + '.' + moveHistoryStrings[2 * turn] + ' '
+                # Makes sure each move is under the same turn (move 1 and 2 is turn 1) (move 5 and 6 is turn 3)
+                if 2 * turn + 1 < len(moveHistoryStrings):  # Makes sure black made a move
+                    text_1 += moveHistoryStrings[2 * turn + 1] + ' '
+        moveHistoryLines.append(font.render(text_1, True, pg.Color('White')))  # Colour of text
 
 '''
-Move animation
+Scrolls the move history panel, positive amounts scroll up towards the first move
 '''
-frames_per_square = 10  # frames to move within a square
-def animate_piece_move(move_1, screen_1, board, clock_1):  # Removed unused parameter
-    frames_per_square = 10  # Moved inside the function to avoid global variable
+def scroll_move_history(amount):
+    global moveHistoryScroll, renderedMoveLogLength
+    moveHistoryScroll = max(0, moveHistoryScroll + amount)
+    renderedMoveLogLength = -1  # Makes the panel draw again on the next frame
+
+
+'''
+Move animation - the board without the moving piece is drawn once, then each frame only puts back the
+square the piece was just on and draws the piece in its new position
+'''
+def animate_piece_move(move_1, screen_1, board, clock_1):
     difference_in_row = move_1.endRow - move_1.startRow
     difference_in_col = move_1.endCol - move_1.startCol
-    frame_count = (abs(difference_in_row) + abs(difference_in_col)) * frames_per_square  # Changed to use local variable
-
-    colours = [pg.Color("white"), pg.Color("#BEE5B0")]  # Added colours definition inside the function
-    for frame in range(frame_count + 1):
-        r, c = (move_1.startRow + difference_in_row * frame / frame_count,
-                move_1.startCol + difference_in_col * frame / frame_count)  # Forming a ratio of the frames
-
-        draw_chessboard(screen_1)
-        render_pieces(screen_1, board)  # Draws the state of the board
-
-        # Need to erase the piece moved from its ending square
-        colour = colours[(move_1.endRow + move_1.endCol) % 2]
-        end_square = pg.Rect(move_1.endCol * squareSize, move_1.endRow * squareSize, squareSize, squareSize)
-        pg.draw.rect(screen_1, colour,
-                     end_square)  # Draws a rectangle of the correct square to erase the piece from the board
-
-        # Draw the captured piece onto the rectangle
-        if move_1.pieceCaptured != '--':
-            if move_1.isEnpassantMove:  # Fixing previous bug where the captured piece would move to its 'captured position' when it should just stay in the same place
-                enpassant_row = (move_1.endRow + 1) if move_1.pieceCaptured[0] == 'b' else move_1.endRow - 1
-                end_square = pg.Rect(move_1.endCol * squareSize, enpassant_row * squareSize, squareSize, squareSize)
-                screen_1.blit(Images[move_1.pieceCaptured], end_square)
-
-        # Drawing the moving piece
-        screen_1.blit(Images[move_1.pieceMoved], pg.Rect(c * squareSize, r * squareSize, squareSize, squareSize))
-        pg.display.flip()
-        clock_1.tick(60)
+    duration = (abs(difference_in_row) + abs(difference_in_col)) * secondsPerSquare  # Based on time so it is the same speed on any computer
+
+    # The move has already been made so the moving piece is taken off its end square
+    static_board = get_board_background().copy()
+    for r in range(boardSize):
+        for c in range(boardSize):
+            piece = board[r][c]
+            if piece != '--' and (r, c) != (move_1.endRow, move_1.endCol):
+                static_board.blit(Images[piece], pg.Rect(c * squareSize, r * squareSize, squareSize, squareSize))
+
+    # Draw the captured piece where it was so that it stays there until the moving piece arrives
+    if move_1.pieceCaptured != '--':
+        # An en passant capture takes a pawn that is next to the start square rather than on the end square
+        captured_row = move_1.startRow if move_1.isEnpassantMove else move_1.endRow
+        static_board.blit(Images[move_1.pieceCaptured], pg.Rect(move_1.endCol * squareSize, captured_row * squareSize, squareSize, squareSize))
+
+    screen_1.blit(static_board, boardRectangle)
+    piece_rect = pg.Rect(move_1.startCol * squareSize, move_1.startRow * squareSize, squareSize, squareSize)
+    pg.display.update(boardRectangle)
+
+    start_time = pg.time.get_ticks()
+    progress = 0
+    while progress < 1:
+        clock_1.tick(animationFrameRate)
+        progress = min(1, (pg.time.get_ticks() - start_time) / 1000 / duration)
+        old_rect = piece_rect.copy()
+        screen_1.blit(static_board, old_rect, old_rect)  # Rubs out the piece from the last frame
+        piece_rect.topleft = (round((move_1.startCol + difference_in_col * progress) * squareSize),
+                              round((move_1.startRow + difference_in_row * progress) * squareSize))  # Forming a ratio of the time
+        screen_1.blit(Images[move_1.pieceMoved], piece_rect)
+        pg.display.update([old_rect, piece_rect])
+
+
+'''
+Waits for the user to pick the piece to promote to - q for Queen, r for Rook, b for Bishop and k for Knight
+'''
+def choose_promotion_piece():
+    promotion_keys = {pg.K_q: 'Q', pg.K_r: 'R', pg.K_b: 'B', pg.K_k: 'N'}
+    while True:
+        event = pg.event.wait()  # Sleeps until there is an event instead of using the CPU
+        if event.type == pg.KEYDOWN and event.key in promotion_keys:
+            return promotion_keys[event.key]
 
 
 def display_game_over_message(screen_1, text_1):
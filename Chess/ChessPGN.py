@@ -0,0 +1,325 @@
+"""
+This file reads and writes games in PGN (Portable Game Notation).
+Moves are written in standard algebraic notation (SAN) with the disambiguation, promotion
+and check/checkmate suffixes that Move.__str__ leaves out.
+Games are read one at a time with a generator, so a file of any size can be read with
+only the game currently being replayed kept in memory.
+"""
+import copy
+
+import ChessEngine
+
+startingFen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+sevenTagRoster = ['Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result']
+results = ['1-0', '0-1', '1/2-1/2', '*']
+maxLineLength = 80  # PGN export format keeps the move text lines to 80 characters
+
+
+'''
+Returns the SAN of a move in the current position, without the check or checkmate suffix.
+valid_moves should be the valid moves of the position, it is only needed for the disambiguation
+'''
+def get_san_without_suffix(move, valid_moves):
+    if move.castle:
+        return 'O-O' if move.endCol > move.startCol else 'O-O-O'
+
+    end_square = move.get_rank_file(move.endRow, move.endCol)
+    is_capture = move.pieceCaptured != '--'  # Move.is_capture misses en passant
+    if move.pieceMoved[1] == 'p':
+        san = (move.colsToFiles[move.startCol] + 'x' if is_capture else '') + end_square
+        if move.isPawnPromotion:
+            san += '=' + move.promotionChoice
+        return san
+
+    # Another piece of the same type that can move to the same square has to be told apart by its file,
+    # then by its rank if they are on the same file, or by both when neither is enough
+    others = [other for other in valid_moves if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow and
+              other.endCol == move.endCol and (other.startRow, other.startCol) != (move.startRow, move.startCol)]
+    disambiguation = ''
+    if len(others) != 0:
+        if all(other.startCol != move.startCol for other in others):
+            disambiguation = move.colsToFiles[move.startCol]
+        elif all(other.startRow != move.startRow for other in others):
+            disambiguation = move.rowsToRanks[move.startRow]
+        else:
+            disambiguation = move.get_rank_file(move.startRow, move.startCol)
+    return move.pieceMoved[1] + disambiguation + ('x' if is_capture else '') + end_square
+
+
+'''
+Returns the full SAN of a move in the current position. The move is made and taken back to find out
+whether it gives check or checkmate
+'''
+def get_san(gs, move, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    san = get_san_without_suffix(move, valid_moves)
+    gs.make_move(move)
+    gs.get_valid_moves()  # Sets isKingInCheck and checkmate for the position after the move
+    if gs.checkmate:
+        san += '#'
+    elif gs.isKingInCheck:
+        san += '+'
+    gs.undo_move()
+    gs.get_valid_moves()  # Puts the checks and pins of the original position back
+    return san
+
+
+'''
+Finds the valid move with the given SAN, e.g. 'Nbd7', 'exd6', 'e8=Q+' or 'O-O'. Annotations like '!?' are ignored,
+and so is a file or rank that isn't needed to tell the move apart (e.g. 'Ngf3'), as long as it is right.
+Raises a ValueError if no valid move matches or more than one does
+'''
+def parse_san(gs, san, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    san = san.rstrip('+#!?').replace('0', 'O')  # Some programs castle with zeros
+    promotion_choice = None
+    if '=' in san:
+        san, promotion_choice = san.split('=')
+    elif len(san) > 2 and san[0].islower() and san[-1] in 'QRBN':
+        san, promotion_choice = san[:-1], san[-1]  # e.g. 'e8Q'
+    if promotion_choice is not None and promotion_choice not in ('Q', 'R', 'B', 'N'):
+        raise ValueError('Not a promotion piece: ' + promotion_choice)
+
+    if san in ('O-O', 'O-O-O'):
+        candidates = [move for move in valid_moves if move.castle and (move.endCol > move.startCol) == (san == 'O-O')]
+    else:
+        if len(san) < 2 or san[-2] not in ChessEngine.Move.filesToCols or san[-1] not in ChessEngine.Move.ranksToRows:
+            raise ValueError('Not a move in SAN: ' + san)
+        end_row, end_col = ChessEngine.Move.ranksToRows[san[-1]], ChessEngine.Move.filesToCols[san[-2]]
+        piece = san[0] if san[0] in 'KQRBN' else 'p'
+        disambiguation = san[1 if piece != 'p' else 0:-2].replace('x', '')
+        start_col = start_row = None
+        for character in disambiguation:
+            if character in ChessEngine.Move.filesToCols and start_col is None:
+                start_col = ChessEngine.Move.filesToCols[character]
+            elif character in ChessEngine.Move.ranksToRows and start_row is None:
+                start_row = ChessEngine.Move.ranksToRows[character]
+            else:
+                raise ValueError('Not a move in SAN: ' + san)
+        if piece == 'p' and start_col is None:
+            start_col = end_col  # A pawn move without a file doesn't capture
+        candidates = [move for move in valid_moves if move.endRow == end_row and move.endCol == end_col and
+                      move.pieceMoved[1] == piece and start_col in (None, move.startCol) and
+                      start_row in (None, move.startRow) and (promotion_choice is not None) == move.isPawnPromotion]
+
+    if len(candidates) != 1:
+        raise ValueError(('No valid move matches ' if len(candidates) == 0 else 'More than one valid move matches ') +
+                         san + ' in ' + gs.get_fen())
+    move = candidates[0]
+    if promotion_choice is not None and promotion_choice != move.promotionChoice:
+        move = copy.copy(move)  # The move cache keeps the original, which has to stay a queen promotion
+        move.promotionChoice = promotion_choice
+    return move
+
+
+'''
+Returns the result of the game so far - checkmate, stalemate and the draw rules, otherwise '*'
+'''
+def get_result(gs):
+    gs.get_valid_moves()
+    if gs.checkmate:
+        return '0-1' if gs.whiteToMove else '1-0'
+    if gs.stalemate or gs.is_draw_by_repetition() or gs.is_draw_by_fifty_move_rule():
+        return '1/2-1/2'
+    return '*'
+
+
+def get_move_log_san(gs):
+    return replay_move_log(gs)[1]
+
+
+'''
+Returns the FEN of the position before the first move in the move log and the SAN of every move. The moves are
+taken back and made again to get each position, so the game state ends up as it started
+'''
+def replay_move_log(gs):
+    moves = list(gs.moveLog)
+    for move in moves:
+        gs.undo_move()
+    start_fen = gs.get_fen()
+    sans = []
+    for move in moves:
+        sans.append(get_san(gs, move))
+        gs.make_move(move)
+    gs.get_valid_moves()
+    return start_fen, sans
+
+
+'''
+Returns the game in the move log as a PGN string. headers can set any tag, the seven tag roster is always written
+and a position that wasn't the normal start is given with the SetUp and FEN tags
+'''
+def get_pgn(gs, headers=None):
+    headers = dict(headers or {})
+    headers.setdefault('Result', get_result(gs))
+
+    start_fen, sans = replay_move_log(gs)
+    white_started = start_fen.split()[1] == 'w'
+    if start_fen != startingFen:
+        headers.setdefault('SetUp', '1')
+        headers.setdefault('FEN', start_fen)
+
+    lines = []
+    for tag in sevenTagRoster + [tag for tag in headers if tag not in sevenTagRoster]:
+        value = str(headers.get(tag, '?')).replace('\\', '\\\\').replace('"', '\\"')
+        lines.append('[' + tag + ' "' + value + '"]')
+    lines.append('')
+
+    move_number = int(start_fen.split()[5])
+    tokens = []
+    for i, san in enumerate(sans):
+        white_to_move = (i % 2 == 0) == white_started
+        if white_to_move:
+            tokens.append(str(move_number) + '.')
+        elif i == 0:
+            tokens.append(str(move_number) + '...')  # The game starts with black to move
+        tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+    tokens.append(headers['Result'])
+
+    line = ''
+    for token in tokens:
+        if len(line) + 1 + len(token) > maxLineLength:
+            lines.append(line)
+            line = token
+        else:
+            line = token if line == '' else line + ' ' + token
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def write_pgn(gs, file, headers=None):
+    file.write(get_pgn(gs, headers) + '\n')  # A blank line between games
+
+
+'''
+Splits move text into its tokens - move numbers, comments, variations and NAGs are dropped.
+The state of an unfinished comment or variation is carried from line to line in state
+'''
+def get_movetext_tokens(line, state):
+    tokens = []
+    token = ''
+    for character in line:
+        if state['comment']:
+            state['comment'] = character != '}'
+            continue
+        if state['variations'] > 0:  # Variations can be nested, only the main line is replayed
+            if character == '(':
+                state['variations'] += 1
+            elif character == ')':
+                state['variations'] -= 1
+            elif character == '{':
+                state['comment'] = True
+            continue
+        if character in ' \t\r\n{(;':
+            if token != '':
+                tokens.append(token)
+                token = ''
+            if character == '{':
+                state['comment'] = True
+            elif character == '(':
+                state['variations'] += 1
+            elif character == ';':
+                break  # The rest of the line is a comment
+            continue
+        token += character
+    if token != '':
+        tokens.append(token)
+
+    moves = []
+    for token in tokens:
+        token = token.split('.')[-1]  # '12.e4' and '12...e5' as well as '12.' on its own
+        if token == '' or token[0] == '$' or token in results:
+            continue
+        moves.append(token)
+    return moves
+
+
+'''
+Reads the games in a PGN file one at a time. Yields (headers, gs) for each game, where gs is a GameState with
+the game made and in its move log. Only one game is kept in memory, so the file can be any size.
+With max_plies only that many moves of each game are made. With skip_invalid a game with a move that can't be
+read is left out instead of raising a ValueError
+'''
+def read_games(file, max_plies=None, skip_invalid=False):
+    headers = {}
+    gs = None
+    is_invalid = False
+    blank_line_seen = False  # Since the last tag, a tag after a blank line with no move text starts the next game
+    state = {'comment': False, 'variations': 0}
+    for line in file:
+        stripped = line.strip()
+        if stripped.startswith('%'):
+            continue  # Escaped line
+        if stripped.startswith('[') and not state['comment'] and state['variations'] == 0:
+            if gs is not None:  # The tags of the next game, so the last one has finished
+                if not is_invalid:
+                    yield headers, gs
+                headers = {}
+                gs = None
+                is_invalid = False
+            elif len(headers) != 0 and blank_line_seen:  # The last game had tags but no move text
+                empty_game = new_tags_only_game(headers, skip_invalid)
+                if empty_game is not None:
+                    yield headers, empty_game
+                headers = {}
+            blank_line_seen = False
+            tag, value = (stripped[1:-1] + ' ').split(' ', 1)
+            value = value.strip()
+            if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+                value = value[1:-1]
+            headers[tag] = value.replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        if stripped == '' and not state['comment']:
+            blank_line_seen = True
+            continue
+        if gs is None:
+            try:
+                gs = new_game(headers)
+            except ValueError:  # A broken FEN tag
+                if not skip_invalid:
+                    raise
+                gs = ChessEngine.GameState()
+                is_invalid = True
+        for san in get_movetext_tokens(line, state):
+            if is_invalid or (max_plies is not None and len(gs.moveLog) >= max_plies):
+                break
+            try:
+                gs.make_move(parse_san(gs, san))
+            except ValueError:
+                if not skip_invalid:
+                    raise
+                is_invalid = True
+    if gs is not None:
+        if not is_invalid:
+            yield headers, gs
+    elif len(headers) != 0:  # Tags with no move text after them
+        empty_game = new_tags_only_game(headers, skip_invalid)
+        if empty_game is not None:
+            yield headers, empty_game
+
+
+'''
+The game of a PGN game with tags but no move text. With skip_invalid a broken FEN tag gives None instead of
+raising a ValueError
+'''
+def new_tags_only_game(headers, skip_invalid):
+    try:
+        return new_game(headers)
+    except ValueError:
+        if not skip_invalid:
+            raise
+        return None
+
+
+'''
+A GameState at the start of the game, which is the FEN tag if there is one
+'''
+def new_game(headers):
+    gs = ChessEngine.GameState()
+    if 'FEN' in headers:
+        gs.load_fen(headers['FEN'])
+    return gs
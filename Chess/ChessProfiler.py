@@ -0,0 +1,112 @@
+"""
+This file is responsible for the opt-in profiling mode. When it is enabled the
+hot functions of the engine and the AI are swapped for wrappers that count the
+calls and time spent in them. When it is disabled the original functions are put
+back, so there is no cost at all unless profiling is switched on.
+"""
+import time
+
+import ChessAI
+import ChessEngine
+
+# The GameState methods that get wrapped, including every function in pieceMovementFunctions
+gameStateFunctions = ['get_valid_moves', 'generate_valid_moves', 'get_all_possible_moves', 'check_for_pins_and_checks',
+                      'static_exchange_evaluation', 'make_move', 'undo_move', 'pawn', 'rook', 'knight', 'bishop', 'queen', 'king']
+
+counters = {}  # Function name -> [number of calls, cumulative time in seconds]
+originalFunctions = {}  # Function name -> the unwrapped function, only filled in while profiling is enabled
+
+
+def is_enabled():
+    return len(originalFunctions) != 0
+
+
+'''
+Makes a wrapper around the function that adds to its counter every time it is called
+'''
+def wrap(name, function):
+    counter = counters.setdefault(name, [0, 0.0])
+    perf_counter = time.perf_counter
+
+    def profiled(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            counter[0] += 1
+            counter[1] += perf_counter() - start
+
+    profiled.__name__ = function.__name__
+    profiled.__wrapped__ = function
+    return profiled
+
+
+'''
+Swaps in the profiled versions of the hot functions.
+GameStates made before this is called should be passed in so their pieceMovementFunctions get the wrappers too
+'''
+def enable(*game_states):
+    if not is_enabled():
+        for name in gameStateFunctions:
+            function = getattr(ChessEngine.GameState, name)
+            originalFunctions['GameState.' + name] = function
+            setattr(ChessEngine.GameState, name, wrap('GameState.' + name, function))
+        originalFunctions['ChessAI.evaluate_board'] = ChessAI.evaluate_board
+        ChessAI.evaluate_board = wrap('ChessAI.evaluate_board', ChessAI.evaluate_board)
+        ChessAI.timeSearchPhases = True
+    for gs in game_states:
+        rebind_piece_functions(gs)
+
+
+'''
+Puts the original functions back
+'''
+def disable(*game_states):
+    if not is_enabled():
+        return
+    for name in gameStateFunctions:
+        setattr(ChessEngine.GameState, name, originalFunctions['GameState.' + name])
+    ChessAI.evaluate_board = originalFunctions['ChessAI.evaluate_board']
+    ChessAI.timeSearchPhases = False
+    originalFunctions.clear()
+    for gs in game_states:
+        rebind_piece_functions(gs)
+
+
+'''
+pieceMovementFunctions holds bound methods, so it has to be rebuilt to pick up (or drop) the wrappers
+'''
+def rebind_piece_functions(gs):
+    for piece, function in gs.pieceMovementFunctions.items():
+        gs.pieceMovementFunctions[piece] = getattr(gs, function.__name__)
+
+
+def reset():
+    for counter in counters.values():
+        counter[0] = 0
+        counter[1] = 0.0
+
+
+'''
+Returns the report as a string, with the functions that took the longest at the top.
+Times are inclusive, so queen includes the time spent in rook and bishop
+'''
+def report():
+    lines = ['{:<36}{:>10}{:>14}{:>14}'.format('function', 'calls', 'total ms', 'per call us')]
+    for name, (calls, total) in sorted(counters.items(), key=lambda item: item[1][1], reverse=True):
+        if calls == 0:
+            continue
+        lines.append('{:<36}{:>10}{:>14.2f}{:>14.2f}'.format(name, calls, total * 1000, total * 1000000 / calls))
+    return '\n'.join(lines) + '\n'
+
+
+'''
+Returns a stats callback for ChessAI.get_best_move that writes the report to the file after every search
+and then clears the counters for the next search
+'''
+def report_after_search(file):
+    def write_report(stats):
+        file.write(report())
+        file.flush()
+        reset()
+    return write_report
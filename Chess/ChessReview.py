@@ -0,0 +1,282 @@
+"""
+This file reviews a finished game. Every position of the game is searched, and each move is given the centipawns
+it lost compared to the best move, so the blunders can be pointed out.
+
+The positions are searched at the same time by a pool of engine processes. The game is split into segments of
+a few plies, and each task searches the positions of its segment from the last one back to the first. The
+transposition table stays filled between those searches, so the positions found deeper in the game are already
+in the table when the earlier position's search gets to them. The pool gives a task to whichever worker is free,
+so the table a task starts with has nothing to do with its segment - each task first searches the overlapPlies
+positions after its segment to seed the table, so its first position gets the same help as the rest.
+Usage: python ChessReview.py games.pgn [profile] [engine processes]
+"""
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessEngine
+import ChessAI
+import ChessPGN
+
+reviewProfileName = 'strong'  # One of the names in ChessAI.engineProfiles
+segmentPlies = 8  # Positions searched one after another by the same task
+overlapPlies = 1  # Positions after the segment searched only to seed the transposition table
+maxReviewScore = 10  # Scores are capped at this many points so that a missed mate doesn't swamp the averages
+# Centipawn losses are 100 times ChessAI's points. The positional tables are on the same scale as the pieces, so
+# ordinary developing moves already move the score by up to this many points, e.g. +4 for a pawn to the centre.
+# Measured on quiet opening moves with the casual, club and strong profiles
+quietMoveSwing = 4
+# So a move only counts once it loses more than that swing plus a pawn, a knight or a rook
+inaccuracyLoss = (quietMoveSwing + ChessAI.chessPieceValuesDictionary['p']) * 100
+mistakeLoss = (quietMoveSwing + ChessAI.chessPieceValuesDictionary['N']) * 100
+blunderLoss = (quietMoveSwing + ChessAI.chessPieceValuesDictionary['R']) * 100
+
+
+'''
+Searches the position with the profile and returns (score, best move, completed depth, nodes). A search that was
+stopped before it finished one ply, or one with no depth at all, uses the static evaluation
+'''
+def search_score(gs, valid_moves, profile):
+    if profile.depth == 0:
+        return ChessAI.evaluate_board(gs) * (1 if gs.whiteToMove else -1), None, 0, 0
+    stats = ChessAI.search_position(gs, valid_moves, profile=profile)
+    score = stats.bestScore
+    if stats.completedDepth == 0:
+        score = ChessAI.evaluate_board(gs) * (1 if gs.whiteToMove else -1)
+    return score, stats.bestMove, stats.completedDepth, stats.nodes + stats.quiescenceNodes
+
+
+'''
+Runs in an engine process. Makes the moves up to overlapPlies past last_ply and searches the positions from there
+back to first_ply, taking a move back after each one. The positions past last_ply belong to the next segment and
+are only searched to seed the transposition table. Returns (ply, score, reply score, best move code, completed depth,
+nodes) for every position. Scores are from the point of view of the player to move in that position - score is
+searched at the profile's depth, and reply score one ply less so that it can be compared with the score of the
+position before (the move that was played makes up the missing ply)
+'''
+def analyse_segment(start_fen, move_codes, first_ply, last_ply, profile_name):
+    profile = ChessAI.engineProfiles[profile_name]
+    # Picking at random between lines would make the scores wrong, so only the best line is searched
+    profile = ChessAI.EngineProfile(profile.name, profile.depth, profile.nodeLimit, profile.timeLimit)
+    reply_profile = ChessAI.EngineProfile(profile.name, profile.depth - 1, profile.nodeLimit, profile.timeLimit)
+    seed_ply = min(last_ply + overlapPlies, len(move_codes))
+    gs = ChessEngine.GameState()
+    gs.load_fen(start_fen)
+    for code in move_codes[:seed_ply]:
+        gs.make_move(gs.get_move_from_code(code))
+
+    results = []
+    for ply in range(seed_ply, first_ply - 1, -1):
+        valid_moves = gs.get_valid_moves()
+        if ply > last_ply:
+            if len(valid_moves) != 0:
+                # The reply search is the one the position before looks up, as the move played is searched one ply less
+                search_score(gs, valid_moves, reply_profile)
+        elif len(valid_moves) == 0:
+            score = -ChessAI.checkmateScore if gs.checkmate else ChessAI.stalemateScore
+            results.append((ply, score, score, None, 0, 0))
+        elif ply == len(move_codes) and (gs.is_draw_by_repetition() or gs.is_draw_by_fifty_move_rule()):
+            results.append((ply, ChessAI.drawScore, ChessAI.drawScore, None, 0, 0))
+        else:
+            # The shallower search goes first, otherwise it would just be answered with the deeper search's scores
+            # from the transposition table
+            reply_score, reply_move, reply_depth, reply_nodes = (0, None, 0, 0) if ply == 0 else \
+                search_score(gs, valid_moves, reply_profile)
+            score, best_move, depth, nodes = search_score(gs, valid_moves, profile) if ply < len(move_codes) else \
+                (0, None, 0, 0)  # Nothing was played from the last position
+            best_code = None if best_move is None else best_move.get_move_code()
+            results.append((ply, score, reply_score, best_code, depth, nodes + reply_nodes))
+        if ply > first_ply:
+            gs.undo_move()
+    return results
+
+
+def get_classification(centipawn_loss):
+    if centipawn_loss >= blunderLoss:
+        return 'blunder'
+    elif centipawn_loss >= mistakeLoss:
+        return 'mistake'
+    elif centipawn_loss >= inaccuracyLoss:
+        return 'inaccuracy'
+    return None
+
+
+'''
+The review of one move. Scores are in points from white's point of view, capped at maxReviewScore
+'''
+class MoveReview:
+    def __init__(self, ply, colour, san, best_san, score_before, score_after, centipawn_loss, depth):
+        self.ply = ply
+        self.colour = colour  # 'w' or 'b', the player who made the move
+        self.san = san
+        self.bestSan = best_san  # None if the engine had no move, e.g. it ran out of time
+        self.scoreBefore = score_before
+        self.scoreAfter = score_after
+        self.centipawnLoss = centipawn_loss
+        self.depth = depth  # Depth of the search of the position before the move
+        self.classification = get_classification(centipawn_loss)
+
+    def get_move_number(self, white_started=True):
+        return (self.ply + (0 if white_started else 1)) // 2 + 1
+
+    def to_dict(self):
+        return {
+            'ply': self.ply,
+            'colour': self.colour,
+            'move': self.san,
+            'bestMove': self.bestSan,
+            'scoreBefore': self.scoreBefore,
+            'scoreAfter': self.scoreAfter,
+            'centipawnLoss': self.centipawnLoss,
+            'classification': self.classification,
+            'depth': self.depth
+        }
+
+
+class GameReview:
+    def __init__(self, start_fen, moves, profile_name, nodes):
+        self.startFen = start_fen
+        self.moves = moves  # A MoveReview for every move of the game
+        self.profileName = profile_name
+        self.nodes = nodes
+
+    def get_moves_by(self, colour):
+        return [move for move in self.moves if move.colour == colour]
+
+    def average_centipawn_loss(self, colour):
+        moves = self.get_moves_by(colour)
+        if len(moves) == 0:
+            return 0.0
+        return sum(move.centipawnLoss for move in moves) / len(moves)
+
+    def get_blunders(self, colour=None):
+        return [move for move in self.moves if move.classification == 'blunder' and colour in (None, move.colour)]
+
+    '''
+    Returns the review as lines of text - the average loss of each player, then every move that lost enough
+    to be called an inaccuracy, mistake or blunder with the move the engine preferred
+    '''
+    def get_report(self):
+        white_started = self.startFen.split()[1] == 'w'
+        lines = []
+        for colour, name in (('w', 'White'), ('b', 'Black')):
+            counts = [len([move for move in self.get_moves_by(colour) if move.classification == classification])
+                      for classification in ('inaccuracy', 'mistake', 'blunder')]
+            lines.append(name + ': average centipawn loss ' + str(round(self.average_centipawn_loss(colour))) + ', ' +
+                         str(counts[0]) + ' inaccuracies, ' + str(counts[1]) + ' mistakes, ' +
+                         str(counts[2]) + ' blunders')
+        for move in self.moves:
+            if move.classification is None:
+                continue
+            number = str(move.get_move_number(white_started)) + ('.' if move.colour == 'w' else '...')
+            line = number + ' ' + move.san + ' - ' + move.classification + ' (-' + str(move.centipawnLoss) + ')'
+            if move.bestSan is not None:
+                line += ', ' + move.bestSan + ' was best'
+            lines.append(line)
+        return lines
+
+    def to_dict(self):
+        return {
+            'startFen': self.startFen,
+            'profile': self.profileName,
+            'nodes': self.nodes,
+            'averageCentipawnLoss': {'w': round(self.average_centipawn_loss('w'), 1),
+                                     'b': round(self.average_centipawn_loss('b'), 1)},
+            'moves': [move.to_dict() for move in self.moves]
+        }
+
+
+def cap_score(score):
+    return max(-maxReviewScore, min(maxReviewScore, score))
+
+
+'''
+A review that is running in a process pool. done can be checked without waiting, e.g. once a frame by ChessMain,
+and result waits for the searches and puts the review together. The game state isn't needed after this is made
+'''
+class ReviewJob:
+    def __init__(self, gs, profile_name=reviewProfileName, workers=None):
+        if profile_name not in ChessAI.engineProfiles:
+            raise ValueError('Unknown profile: ' + str(profile_name))
+        self.profileName = profile_name
+        self.startFen, self.sans = ChessPGN.replay_move_log(gs)
+        self.moveCodes = [move.get_move_code() for move in gs.moveLog]
+        self.review = None
+        self.executor = ProcessPoolExecutor(workers)
+        self.tasks = []
+        last_ply = len(self.moveCodes)
+        while last_ply >= 0:  # Handed out from the end of the game
+            first_ply = max(last_ply - segmentPlies + 1, 0)
+            self.tasks.append(self.executor.submit(analyse_segment, self.startFen, self.moveCodes, first_ply, last_ply,
+                                                   profile_name))
+            last_ply = first_ply - 1
+
+    def done(self):
+        return all(task.done() for task in self.tasks)
+
+    '''
+    The fraction of the segments that have been searched
+    '''
+    def progress(self):
+        return sum(1 for task in self.tasks if task.done()) / len(self.tasks)
+
+    def cancel(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def result(self):
+        if self.review is not None:
+            return self.review
+        try:
+            positions = {}
+            for task in self.tasks:
+                for ply, score, reply_score, best_code, depth, nodes in task.result():
+                    positions[ply] = (score, reply_score, best_code, depth, nodes)
+        finally:
+            self.executor.shutdown()
+        self.review = self.make_review(positions)
+        return self.review
+
+    '''
+    The played move's score is the reply score of the position after it, turned round to the mover's point of view.
+    The best move always loses nothing, even when the two searches disagree by a little
+    '''
+    def make_review(self, positions):
+        gs = ChessEngine.GameState()
+        gs.load_fen(self.startFen)
+        moves = []
+        for ply, code in enumerate(self.moveCodes):
+            score, reply_score, best_code, depth, nodes = positions[ply]
+            best_score = cap_score(score)
+            played_score = cap_score(-positions[ply + 1][1])
+            loss = 0 if code == best_code else max(round((best_score - played_score) * 100), 0)
+            best_move = None if best_code is None else gs.get_move_from_code(best_code)
+            best_san = None if best_move is None else ChessPGN.get_san(gs, best_move)
+            sign = 1 if gs.whiteToMove else -1
+            moves.append(MoveReview(ply, 'w' if gs.whiteToMove else 'b', self.sans[ply], best_san, sign * best_score,
+                                    sign * played_score, loss, depth))
+            gs.make_move(gs.get_move_from_code(code))
+        return GameReview(self.startFen, moves, self.profileName, sum(position[4] for position in positions.values()))
+
+
+'''
+Reviews the game in the move log and waits for the result
+'''
+def review_game(gs, profile_name=reviewProfileName, workers=None):
+    return ReviewJob(gs, profile_name, workers).result()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python ChessReview.py games.pgn [profile] [engine processes]')
+        sys.exit(2)
+    profile_name = sys.argv[2] if len(sys.argv) > 2 else reviewProfileName
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    with open(sys.argv[1], encoding='utf-8') as file:
+        for headers, gs in ChessPGN.read_games(file):
+            print(headers.get('White', '?') + ' - ' + headers.get('Black', '?') + ' ' + headers.get('Result', '*'))
+            for line in review_game(gs, profile_name, workers).get_report():
+                print(line)
+            print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+This file is the game server. It holds many games at once and runs the AI searches for all of them in a
+pool of engine processes, so one machine can host lots of human vs AI games.
+
+Clients connect over TCP or a Unix socket and send one JSON object per line. Every request can have an "id",
+which is copied into its response so that a client can have several requests waiting at once:
+
+    {"type": "new_game", "fen": "..."}                 -> the game id and the position ("fen" is optional)
+    {"type": "move", "game": 1, "move": "e7e8q"}       -> the position after the move, in UCI notation
+    {"type": "undo", "game": 1}                        -> the position after taking back the last move
+    {"type": "ai_move", "game": 1, "timeLimit": 5, "profile": "club"}
+                                                       -> the move the AI picks, made in the game unless "apply" is false
+    {"type": "position", "game": 1}                    -> the position
+    {"type": "close_game", "game": 1}
+    {"type": "metrics"}                                -> queue depth and search counts
+
+"profile" is the name of one of ChessAI.engineProfiles. The engine is told to stop a little before the time limit
+so that it answers with the best move it has found. Errors come back as {"error": "..."}, and a search that is
+still over its time limit (e.g. waiting for an engine process) is answered with an error straight away.
+When more searches are waiting for an engine process than maxQueuedSearches, new ones are turned away as busy.
+Games belong to the connection that made them and are closed when it disconnects.
+Usage: python ChessServer.py [port | unix:path] [engine processes]
+"""
+import asyncio
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import ChessEngine
+import ChessAI
+
+defaultPort = 8765
+maxQueuedSearches = 64  # Searches waiting for an engine process before new ones are turned away
+maxRequestsPerConnection = 8  # The server stops reading from a connection with this many requests unanswered
+defaultSearchTimeLimit = 30.0  # Seconds
+engineTimeShare = 0.9  # Of the time left when the search starts, the rest is for replaying the game and the reply
+
+
+'''
+Returns the valid move with the UCI notation, raises a ValueError if there isn't one
+'''
+def find_move(gs, uci):
+    for move in gs.get_valid_moves():
+        if move.get_move_in_chess_notation() == uci[:4]:
+            if move.isPawnPromotion and len(uci) > 4 and uci[4].upper() != move.promotionChoice:
+                move = ChessEngine.Move((move.startRow, move.startCol), (move.endRow, move.endCol), gs.board)
+                move.promotionChoice = uci[4].upper()  # A new move so the cached one stays a queen
+            return move
+    raise ValueError('Illegal move: ' + str(uci))
+
+
+'''
+Runs in an engine process. The game is made again from its start position so that the search knows about
+repetitions. Returns the move in UCI notation and the search stats
+'''
+def search_game(start_fen, moves, profile_name, time_limit):
+    gs = ChessEngine.GameState()
+    gs.load_fen(start_fen)
+    for uci in moves:
+        gs.make_move(find_move(gs, uci))
+    valid_moves = gs.get_valid_moves()
+    if len(valid_moves) == 0:
+        raise ValueError('The game is over')
+    profile = ChessAI.engineProfiles[profile_name].with_time_limit(time_limit)
+    stats = ChessAI.search_position(gs, valid_moves, profile=profile)
+    move = stats.bestMove if stats.bestMove is not None else ChessAI.choose_random_move(valid_moves)
+    return move.get_move_in_uci_notation(), stats.to_dict()
+
+
+class ServerBusy(Exception):
+    pass
+
+
+'''
+One game on the server. The lock stops two requests changing the game at the same time
+'''
+class GameSession:
+    def __init__(self, game_id, fen=None):
+        self.gameId = game_id
+        self.gs = ChessEngine.GameState()
+        if fen is not None:
+            self.gs.load_fen(fen)
+        self.startFen = self.gs.get_fen()
+        self.moves = []  # UCI notation of every move made, to send to the engine processes
+        self.lock = asyncio.Lock()
+
+    def make_move(self, uci):
+        move = find_move(self.gs, uci)
+        self.gs.make_move(move)
+        self.moves.append(move.get_move_in_uci_notation())
+
+    def undo_move(self):
+        if len(self.moves) == 0:
+            raise ValueError('There are no moves to take back')
+        self.gs.undo_move()
+        self.moves.pop()
+
+    def get_status(self):
+        self.gs.get_valid_moves()
+        if self.gs.checkmate:
+            return 'checkmate'
+        elif self.gs.stalemate:
+            return 'stalemate'
+        elif self.gs.is_draw_by_repetition():
+            return 'repetition'
+        elif self.gs.is_draw_by_fifty_move_rule():
+            return 'fiftyMoveRule'
+        return 'playing'
+
+    def to_dict(self):
+        return {
+            'game': self.gameId,
+            'fen': self.gs.get_fen(),
+            'moves': self.moves,
+            'legalMoves': [move.get_move_in_uci_notation() for move in self.gs.get_valid_moves()],
+            'status': self.get_status()
+        }
+
+
+class ChessServer:
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.searchSlots = None  # Made in start, it has to belong to the running event loop
+        self.sessions = {}
+        self.nextGameId = 1
+        self.connections = 0
+        self.queuedSearches = 0
+        self.maxQueueDepth = 0
+        self.activeSearches = 0
+        self.searchesCompleted = 0
+        self.searchesTimedOut = 0
+        self.searchesRejected = 0
+        self.totalSearchTime = 0.0
+        self.poolRestarts = 0
+
+    async def start(self, address):
+        self.searchSlots = asyncio.Semaphore(self.workers)
+        if isinstance(address, str):
+            return await asyncio.start_unix_server(self.handle_connection, address)
+        return await asyncio.start_server(self.handle_connection, address[0], address[1])
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_metrics(self):
+        return {
+            'workers': self.workers,
+            'connections': self.connections,
+            'games': len(self.sessions),
+            'queueDepth': self.queuedSearches,
+            'maxQueueDepth': self.maxQueueDepth,
+            'activeSearches': self.activeSearches,
+            'searchesCompleted': self.searchesCompleted,
+            'searchesTimedOut': self.searchesTimedOut,
+            'searchesRejected': self.searchesRejected,
+            'averageSearchTime': round(self.totalSearchTime / self.searchesCompleted, 4) if self.searchesCompleted else 0.0,
+            'poolRestarts': self.poolRestarts
+        }
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        game_ids = set()  # The games made by this connection
+        unanswered = asyncio.Semaphore(maxRequestsPerConnection)
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                await unanswered.acquire()  # Not reading any more lines makes a client that sends too much wait
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer, write_lock, game_ids, unanswered))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        except ValueError:  # A line over the stream's limit, the rest of the stream can't be trusted so it is closed
+            try:
+                async with write_lock:
+                    writer.write((json.dumps({'error': 'The request is too long', 'id': None}) + '\n').encode())
+                    await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for game_id in game_ids:
+                self.sessions.pop(game_id, None)
+            self.connections -= 1
+            writer.close()
+
+    async def answer(self, line, writer, write_lock, game_ids, unanswered):
+        request = {}
+        try:
+            parsed = json.loads(line)
+            if not isinstance(parsed, dict):
+                raise ValueError('A request has to be a JSON object')
+            request = parsed
+            response = await self.handle_request(request, game_ids)
+        except ServerBusy:
+            response = {'error': 'busy'}
+        except asyncio.TimeoutError:
+            response = {'error': 'timeout'}
+        except (ValueError, KeyError, TypeError) as error:
+            response = {'error': str(error)}
+        except Exception as error:  # e.g. a broken engine process, the client still gets an answer
+            response = {'error': type(error).__name__ + ': ' + str(error)}
+        finally:
+            unanswered.release()
+        response['id'] = request.get('id')
+        async with write_lock:
+            writer.write((json.dumps(response) + '\n').encode())
+            await writer.drain()
+
+    async def handle_request(self, request, game_ids):
+        request_type = request.get('type')
+        if request_type == 'metrics':
+            return self.get_metrics()
+        if request_type == 'new_game':
+            session = GameSession(self.nextGameId, request.get('fen'))
+            self.nextGameId += 1
+            self.sessions[session.gameId] = session
+            game_ids.add(session.gameId)
+            return session.to_dict()
+
+        game_id = request.get('game')
+        if game_id not in game_ids:
+            raise ValueError('No game ' + str(game_id) + ' on this connection')
+        session = self.sessions[game_id]
+        async with session.lock:
+            if request_type == 'position':
+                return session.to_dict()
+            elif request_type == 'move':
+                session.make_move(request['move'])
+                return session.to_dict()
+            elif request_type == 'undo':
+                session.undo_move()
+                return session.to_dict()
+            elif request_type == 'ai_move':
+                moves = list(session.moves)
+            elif request_type == 'close_game':
+                del self.sessions[game_id]
+                game_ids.discard(game_id)
+                return {'game': game_id, 'closed': True}
+            else:
+                raise ValueError('Unknown request type: ' + str(request_type))
+
+        # The game isn't locked during the search so that the client can still take moves back while it waits
+        profile_name = request.get('profile', ChessAI.defaultProfile.name)
+        if profile_name not in ChessAI.engineProfiles:
+            raise ValueError('Unknown profile: ' + str(profile_name))
+        uci, stats = await self.search(session.startFen, moves, profile_name,
+                                       float(request.get('timeLimit', defaultSearchTimeLimit)))
+        async with session.lock:
+            if request.get('apply', True):
+                if session.moves != moves or self.sessions.get(game_id) is not session:
+                    raise ValueError('The game changed during the search')
+                session.make_move(uci)
+            response = session.to_dict()
+        response.update({'move': uci, 'stats': stats})
+        return response
+
+    '''
+    Waits for a free engine process and runs the search in it. An engine process can't be stopped part way
+    through a search, so one that is over its time limit keeps its process until it finishes
+    '''
+    async def search(self, start_fen, moves, profile_name, time_limit):
+        start = time.perf_counter()
+        if not self.searchSlots.locked():
+            await self.searchSlots.acquire()  # An engine process is free so this doesn't wait
+        else:
+            if self.queuedSearches >= maxQueuedSearches:
+                self.searchesRejected += 1
+                raise ServerBusy()
+            self.queuedSearches += 1
+            self.maxQueueDepth = max(self.maxQueueDepth, self.queuedSearches)
+            try:
+                await asyncio.wait_for(self.searchSlots.acquire(), time_limit)
+            except asyncio.TimeoutError:
+                self.searchesTimedOut += 1
+                raise
+            finally:
+                self.queuedSearches -= 1
+
+        self.activeSearches += 1
+        engine_time_limit = max(time_limit - (time.perf_counter() - start), 0) * engineTimeShare
+        executor = self.executor
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, search_game, start_fen, moves,
+                                                                profile_name, engine_time_limit)
+        except BaseException as error:  # Never started, so the slot is given back straight away
+            self.activeSearches -= 1
+            self.searchSlots.release()
+            if isinstance(error, BrokenProcessPool):
+                self.replace_executor(executor)
+            raise
+        future.add_done_callback(functools.partial(self.search_finished, executor))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), max(time_limit - (time.perf_counter() - start), 0))
+        except asyncio.TimeoutError:
+            self.searchesTimedOut += 1
+            raise
+        self.searchesCompleted += 1
+        self.totalSearchTime += time.perf_counter() - start
+        return result
+
+    def search_finished(self, executor, future):
+        self.activeSearches -= 1
+        self.searchSlots.release()
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):  # Also marks it as seen
+            self.replace_executor(executor)
+
+    '''
+    A pool with a dead engine process (e.g. it was killed) fails every search, so a new one is made.
+    Only the pool that broke is replaced, every search that was running in it reports the same thing
+    '''
+    def replace_executor(self, broken_executor):
+        if self.executor is not broken_executor:
+            return
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.poolRestarts += 1
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    address = ('127.0.0.1', defaultPort)
+    if len(sys.argv) > 1:
+        address = sys.argv[1][len('unix:'):] if sys.argv[1].startswith('unix:') else ('127.0.0.1', int(sys.argv[1]))
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    async def serve():
+        server = ChessServer(workers)
+        listener = await server.start(address)
+        print('Serving on ' + str(address) + ' with ' + str(server.workers) + ' engine processes')
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -3,107 +3,158 @@ import board, pieces, numpy
 class Heuristics:
 
     # The tables denote the points scored for the position of the chess pieces on the board.
+    # Every table is laid out as the board is seen from White's side, so the top row is the eighth rank (y = 0).
 
     PAWN_TABLE = numpy.array([
         [ 0,  0,  0,  0,  0,  0,  0,  0],
-        [ 5, 10, 10,-20,-20, 10, 10,  5],
-        [ 5, -5,-10,  0,  0,-10, -5,  5],
-        [ 0,  0,  0, 20, 20,  0,  0,  0],
-        [ 5,  5, 10, 25, 25, 10,  5,  5],
-        [10, 10, 20, 30, 30, 20, 10, 10],
         [50, 50, 50, 50, 50, 50, 50, 50],
+        [10, 10, 20, 30, 30, 20, 10, 10],
+        [ 5,  5, 10, 25, 25, 10,  5,  5],
+        [ 0,  0,  0, 20, 20,  0,  0,  0],
+        [ 5, -5,-10,  0,  0,-10, -5,  5],
+        [ 5, 10, 10,-20,-20, 10, 10,  5],
         [ 0,  0,  0,  0,  0,  0,  0,  0]
     ])
 
     KNIGHT_TABLE = numpy.array([
         [-50, -40, -30, -30, -30, -30, -40, -50],
-        [-40, -20,   0,   5,   5,   0, -20, -40],
-        [-30,   5,  10,  15,  15,  10,   5, -30],
-        [-30,   0,  15,  20,  20,  15,   0, -30],
-        [-30,   5,  15,  20,  20,  15,   0, -30],
-        [-30,   0,  10,  15,  15,  10,   0, -30],
         [-40, -20,   0,   0,   0,   0, -20, -40],
+        [-30,   0,  10,  15,  15,  10,   0, -30],
+        [-30,   5,  15,  20,  20,  15,   0, -30],
+        [-30,   0,  15,  20,  20,  15,   0, -30],
+        [-30,   5,  10,  15,  15,  10,   5, -30],
+        [-40, -20,   0,   5,   5,   0, -20, -40],
         [-50, -40, -30, -30, -30, -30, -40, -50]
     ])
 
     BISHOP_TABLE = numpy.array([
         [-20, -10, -10, -10, -10, -10, -10, -20],
-        [-10,   5,   0,   0,   0,   0,   5, -10],
-        [-10,  10,  10,  10,  10,  10,  10, -10],
-        [-10,   0,  10,  10,  10,  10,   0, -10],
-        [-10,   5,   5,  10,  10,   5,   5, -10],
-        [-10,   0,   5,  10,  10,   5,   0, -10],
         [-10,   0,   0,   0,   0,   0,   0, -10],
+        [-10,   0,   5,  10,  10,   5,   0, -10],
+        [-10,   5,   5,  10,  10,   5,   5, -10],
+        [-10,   0,  10,  10,  10,  10,   0, -10],
+        [-10,  10,  10,  10,  10,  10,  10, -10],
+        [-10,   5,   0,   0,   0,   0,   5, -10],
         [-20, -10, -10, -10, -10, -10, -10, -20]
     ])
 
     ROOK_TABLE = numpy.array([
-        [ 0,  0,  0,  5,  5,  0,  0,  0],
+        [ 0,  0,  0,  0,  0,  0,  0,  0],
+        [ 5, 10, 10, 10, 10, 10, 10,  5],
         [-5,  0,  0,  0,  0,  0,  0, -5],
         [-5,  0,  0,  0,  0,  0,  0, -5],
         [-5,  0,  0,  0,  0,  0,  0, -5],
         [-5,  0,  0,  0,  0,  0,  0, -5],
         [-5,  0,  0,  0,  0,  0,  0, -5],
-        [ 5, 10, 10, 10, 10, 10, 10,  5],
-        [ 0,  0,  0,  0,  0,  0,  0,  0]
+        [ 0,  0,  0,  5,  5,  0,  0,  0]
     ])
 
     QUEEN_TABLE = numpy.array([
         [-20, -10, -10, -5, -5, -10, -10, -20],
-        [-10,   0,   5,  0,  0,   0,   0, -10],
-        [-10,   5,   5,  5,  5,   5,   0, -10],
-        [  0,   0,   5,  5,  5,   5,   0,  -5],
-        [ -5,   0,   5,  5,  5,   5,   0,  -5],
-        [-10,   0,   5,  5,  5,   5,   0, -10],
         [-10,   0,   0,  0,  0,   0,   0, -10],
+        [-10,   0,   5,  5,  5,   5,   0, -10],
+        [ -5,   0,   5,  5,  5,   5,   0,  -5],
+        [  0,   0,   5,  5,  5,   5,   0,  -5],
+        [-10,   5,   5,  5,  5,   5,   0, -10],
+        [-10,   0,   5,  0,  0,   0,   0, -10],
         [-20, -10, -10, -5, -5, -10, -10, -20]
     ])
 
-    @staticmethod
-    def evaluate(board):
-        material = Heuristics.get_material_score(board)
+    # Pawns near promotion and an active king matter more once most of the pieces are gone, so these have a
+    # middlegame and an endgame table that are blended by the game phase.
+    PAWN_ENDGAME_TABLE = numpy.array([
+        [ 0,  0,  0,  0,  0,  0,  0,  0],
+        [80, 80, 80, 80, 80, 80, 80, 80],
+        [55, 55, 55, 55, 55, 55, 55, 55],
+        [35, 35, 35, 35, 35, 35, 35, 35],
+        [20, 20, 20, 20, 20, 20, 20, 20],
+        [10, 10, 10, 10, 10, 10, 10, 10],
+        [ 0,  0,  0,  0,  0,  0,  0,  0],
+        [ 0,  0,  0,  0,  0,  0,  0,  0]
+    ])
+
+    KING_MIDDLEGAME_TABLE = numpy.array([
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-20, -30, -30, -40, -40, -30, -30, -20],
+        [-10, -20, -20, -20, -20, -20, -20, -10],
+        [ 20,  20,   0,   0,   0,   0,  20,  20],
+        [ 20,  30,  10,   0,   0,  10,  30,  20]
+    ])
 
-        pawns = Heuristics.get_piece_position_score(board, pieces.Pawn.PIECE_TYPE, Heuristics.PAWN_TABLE)
-        knights = Heuristics.get_piece_position_score(board, pieces.Knight.PIECE_TYPE, Heuristics.KNIGHT_TABLE)
-        bishops = Heuristics.get_piece_position_score(board, pieces.Bishop.PIECE_TYPE, Heuristics.BISHOP_TABLE)
-        rooks = Heuristics.get_piece_position_score(board, pieces.Rook.PIECE_TYPE, Heuristics.ROOK_TABLE)
-        queens = Heuristics.get_piece_position_score(board, pieces.Queen.PIECE_TYPE, Heuristics.QUEEN_TABLE)
+    KING_ENDGAME_TABLE = numpy.array([
+        [-50, -40, -30, -20, -20, -30, -40, -50],
+        [-30, -20, -10,   0,   0, -10, -20, -30],
+        [-30, -10,  20,  30,  30,  20, -10, -30],
+        [-30, -10,  30,  40,  40,  30, -10, -30],
+        [-30, -10,  30,  40,  40,  30, -10, -30],
+        [-30, -10,  20,  30,  30,  20, -10, -30],
+        [-30, -30,   0,   0,   0,   0, -30, -30],
+        [-50, -30, -30, -30, -30, -30, -30, -50]
+    ])
 
-        return material + pawns + knights + bishops + rooks + queens
+    # How much each piece code counts towards the game phase, indexed like MATERIAL_BY_CODE.
+    # All the pieces at the start add up to MAX_PHASE, an endgame with only kings and pawns is 0.
+    PHASE_BY_CODE = numpy.array([0, 4, 2, 1, 1, 0, 0, 0, 1, 1, 2, 4, 0])
+    MAX_PHASE = 24
+
+    # Material value of each piece code. Black's codes are negative so the index is offset by 6.
+    MATERIAL_BY_CODE = numpy.array([-pieces.King.VALUE, -pieces.Queen.VALUE, -pieces.Rook.VALUE,
+                                    -pieces.Bishop.VALUE, -pieces.Knight.VALUE, -pieces.Pawn.VALUE, 0,
+                                    pieces.Pawn.VALUE, pieces.Knight.VALUE, pieces.Bishop.VALUE,
+                                    pieces.Rook.VALUE, pieces.Queen.VALUE, pieces.King.VALUE])
+
+    # (piece type, table for white, table for black). board.codes is indexed [x][y], so the tables are transposed
+    # to match, and black uses the table flipped top to bottom, i.e. table[y][x] becomes table[7 - y][x].
+    POSITION_TABLES = ((pieces.Knight.PIECE_TYPE, KNIGHT_TABLE.T, KNIGHT_TABLE.T[:, ::-1]),
+                       (pieces.Bishop.PIECE_TYPE, BISHOP_TABLE.T, BISHOP_TABLE.T[:, ::-1]),
+                       (pieces.Rook.PIECE_TYPE, ROOK_TABLE.T, ROOK_TABLE.T[:, ::-1]),
+                       (pieces.Queen.PIECE_TYPE, QUEEN_TABLE.T, QUEEN_TABLE.T[:, ::-1]))
+
+    # (piece type, middlegame table for white, for black, endgame table for white, for black), the same way round.
+    TAPERED_TABLES = ((pieces.Pawn.PIECE_TYPE, PAWN_TABLE.T, PAWN_TABLE.T[:, ::-1],
+                       PAWN_ENDGAME_TABLE.T, PAWN_ENDGAME_TABLE.T[:, ::-1]),
+                      (pieces.King.PIECE_TYPE, KING_MIDDLEGAME_TABLE.T, KING_MIDDLEGAME_TABLE.T[:, ::-1],
+                       KING_ENDGAME_TABLE.T, KING_ENDGAME_TABLE.T[:, ::-1]))
+
+    # Scores the board from the numpy array of piece codes, so there is no loop over the 64 squares.
+    @staticmethod
+    def evaluate(board):
+        score = Heuristics.get_material_score(board)
+        for (piece_type, table, black_table) in Heuristics.POSITION_TABLES:
+            code = board.PIECE_CODES[piece_type]
+            score += int(table[board.codes == code].sum()) - int(black_table[board.codes == -code].sum())
+
+        # Tapered evaluation, all middlegame with every piece on the board and all endgame with none.
+        phase = Heuristics.get_phase(board)
+        for (piece_type, middlegame_table, middlegame_black_table, endgame_table, endgame_black_table) in Heuristics.TAPERED_TABLES:
+            white = board.codes == board.PIECE_CODES[piece_type]
+            black = board.codes == -board.PIECE_CODES[piece_type]
+            middlegame = int(middlegame_table[white].sum()) - int(middlegame_black_table[black].sum())
+            endgame = int(endgame_table[white].sum()) - int(endgame_black_table[black].sum())
+            score += (middlegame * phase + endgame * (Heuristics.MAX_PHASE - phase)) // Heuristics.MAX_PHASE
+        return score
+
+    # Promotions can take the phase above the maximum, so it is capped.
+    @staticmethod
+    def get_phase(board):
+        return min(int(Heuristics.PHASE_BY_CODE[board.codes + 6].sum()), Heuristics.MAX_PHASE)
 
     # Returns the score for the position of the given type of piece.
     # A piece type can for example be: pieces.Pawn.PIECE_TYPE.
     # The table is the 2d numpy array used for the scoring. Example: Heuristics.PAWN_TABLE
     @staticmethod
     def get_piece_position_score(board, piece_type, table):
-        white = 0
-        black = 0
-        for x in range(8):
-            for y in range(8):
-                piece = board.chesspieces[x][y]
-                if (piece != 0):
-                    if (piece.piece_type == piece_type):
-                        if (piece.color == pieces.Piece.WHITE):
-                            white += table[x][y]
-                        else:
-                            black += table[7 - x][y]
-
-        return white - black
+        code = board.PIECE_CODES[piece_type]
+        white = table.T[board.codes == code].sum()
+        black = table.T[:, ::-1][board.codes == -code].sum()
+        return int(white - black)
 
     @staticmethod
     def get_material_score(board):
-        white = 0
-        black = 0
-        for x in range(8):
-            for y in range(8):
-                piece = board.chesspieces[x][y]
-                if (piece != 0):
-                    if (piece.color == pieces.Piece.WHITE):
-                        white += piece.value
-                    else:
-                        black += piece.value
-
-        return white - black
+        return int(Heuristics.MATERIAL_BY_CODE[board.codes + 6].sum())
 
 
 class AI:
@@ -112,30 +163,22 @@ class AI:
 
     @staticmethod
     def get_ai_move(chessboard, invalid_moves):
+        invalid_keys = set(move.key() for move in invalid_moves)
         best_move = 0
         best_score = AI.INFINITE
-        for move in chessboard.get_possible_moves(pieces.Piece.BLACK):
-            if (AI.is_invalid_move(move, invalid_moves)):
+        # Moves that leave Black in check are filtered out once here, so the search only runs once.
+        for move in chessboard.get_legal_moves(pieces.Piece.BLACK):
+            if (move.key() in invalid_keys):
                 continue
 
-            copy = board.Board.clone(chessboard)
-            copy.perform_move(move)
-
-            score = AI.alphabeta(copy, 2, -AI.INFINITE, AI.INFINITE, True)
+            token = chessboard.perform_move(move)
+            score = AI.alphabeta(chessboard, 2, -AI.INFINITE, AI.INFINITE, True)
+            chessboard.undo_move(token)
             if (score < best_score):
                 best_score = score
                 best_move = move
 
-        # Checkmate.
-        if (best_move == 0):
-            return 0
-
-        copy = board.Board.clone(chessboard)
-        copy.perform_move(best_move)
-        if (copy.is_check(pieces.Piece.BLACK)):
-            invalid_moves.append(best_move)
-            return AI.get_ai_move(chessboard, invalid_moves)
-
+        # Checkmate or stalemate if there were no legal moves.
         return best_move
 
     @staticmethod
@@ -153,20 +196,18 @@ class AI:
         if (maximizing):
             best_score = -AI.INFINITE
             for move in board.get_possible_moves(pieces.Piece.WHITE):
-                copy = board.Board.clone(board)
-                copy.perform_move(move)
-
-                score = AI.minimax(copy, depth-1, False)
+                token = board.perform_move(move)
+                score = AI.minimax(board, depth-1, False)
+                board.undo_move(token)
                 best_score = max(best_score, score)
 
             return best_score
         else:
             best_score = AI.INFINITE
             for move in board.get_possible_moves(pieces.Piece.BLACK):
-                copy = board.Board.clone(board)
-                copy.perform_move(move)
-
-                score = AI.minimax(copy, depth-1, True)
+                token = board.perform_move(move)
+                score = AI.minimax(board, depth-1, True)
+                board.undo_move(token)
                 best_score = min(best_score, score)
 
             return best_score
@@ -179,10 +220,9 @@ class AI:
         if (maximizing):
             best_score = -AI.INFINITE
             for move in chessboard.get_possible_moves(pieces.Piece.WHITE):
-                copy = board.Board.clone(chessboard)
-                copy.perform_move(move)
-
-                best_score = max(best_score, AI.alphabeta(copy, depth-1, a, b, False))
+                token = chessboard.perform_move(move)
+                best_score = max(best_score, AI.alphabeta(chessboard, depth-1, a, b, False))
+                chessboard.undo_move(token)
                 a = max(a, best_score)
                 if (b <= a):
                     break
@@ -190,10 +230,9 @@ class AI:
         else:
             best_score = AI.INFINITE
             for move in chessboard.get_possible_moves(pieces.Piece.BLACK):
-                copy = board.Board.clone(chessboard)
-                copy.perform_move(move)
-
-                best_score = min(best_score, AI.alphabeta(copy, depth-1, a, b, True))
+                token = chessboard.perform_move(move)
+                best_score = min(best_score, AI.alphabeta(chessboard, depth-1, a, b, True))
+                chessboard.undo_move(token)
                 b = min(b, best_score)
                 if (b <= a):
                     break
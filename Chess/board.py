@@ -1,3 +1,5 @@
+import numpy
+
 import pieces
 from move import Move
 
@@ -6,11 +8,33 @@ class Board:
     WIDTH = 8
     HEIGHT = 8
 
+    KNIGHT_OFFSETS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+    KING_OFFSETS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+
+    # Each piece type has a code, positive for white and negative for black.
+    PIECE_CODES = {pieces.Pawn.PIECE_TYPE: 1, pieces.Knight.PIECE_TYPE: 2, pieces.Bishop.PIECE_TYPE: 3,
+                   pieces.Rook.PIECE_TYPE: 4, pieces.Queen.PIECE_TYPE: 5, pieces.King.PIECE_TYPE: 6}
+
     def __init__(self, chesspieces, white_king_moved, black_king_moved):
         self.chesspieces = chesspieces
         self.white_king_moved = white_king_moved
         self.black_king_moved = black_king_moved
 
+        # The same board as chesspieces, but as piece codes (0 for empty) in a numpy array
+        # so the heuristics can score the whole board at once. Kept up to date by move_piece.
+        self.codes = numpy.zeros((Board.WIDTH, Board.HEIGHT), dtype=numpy.int8)
+        for x in range(Board.WIDTH):
+            for y in range(Board.HEIGHT):
+                if (chesspieces[x][y] != 0):
+                    self.codes[x, y] = Board.get_code(chesspieces[x][y])
+
+    # Returns the code of the given piece, positive for white and negative for black.
+    @staticmethod
+    def get_code(piece):
+        if (piece.color == pieces.Piece.WHITE):
+            return Board.PIECE_CODES[piece.piece_type]
+        return -Board.PIECE_CODES[piece.piece_type]
+
     @classmethod
     def clone(cls, chessboard):
         chesspieces = [[0 for x in range(Board.WIDTH)] for y in range(Board.HEIGHT)]
@@ -58,6 +82,29 @@ class Board:
 
         return cls(chess_pieces, False, False)
 
+    # Creates a board from the piece placement and castling fields of a FEN string.
+    # The board doesn't track rooks moving, so a king can castle unless both of its castling rights are gone.
+    @classmethod
+    def from_fen(cls, fen):
+        piece_classes = {'P': pieces.Pawn, 'N': pieces.Knight, 'B': pieces.Bishop,
+                         'R': pieces.Rook, 'Q': pieces.Queen, 'K': pieces.King}
+        fields = fen.split()
+        chess_pieces = [[0 for x in range(Board.WIDTH)] for y in range(Board.HEIGHT)]
+        for y, rank in enumerate(fields[0].split('/')):
+            x = 0
+            for character in rank:
+                if (character.isdigit()):
+                    x += int(character)
+                else:
+                    color = pieces.Piece.WHITE if character.isupper() else pieces.Piece.BLACK
+                    chess_pieces[x][y] = piece_classes[character.upper()](x, y, color)
+                    x += 1
+
+        castling = fields[2] if len(fields) > 2 else '-'
+        white_king_moved = 'K' not in castling and 'Q' not in castling
+        black_king_moved = 'k' not in castling and 'q' not in castling
+        return cls(chess_pieces, white_king_moved, black_king_moved)
+
     def get_possible_moves(self, color):
         moves = []
         for x in range(Board.WIDTH):
@@ -69,14 +116,22 @@ class Board:
 
         return moves
 
+    # Makes the move on this board and returns an undo token. Passing the token to
+    # undo_move puts the board back exactly how it was, so searches don't need to clone.
     def perform_move(self, move):
         piece = self.chesspieces[move.xfrom][move.yfrom]
+        taken = self.chesspieces[move.xto][move.yto]
+        rook = 0
+        rook_xfrom = 0
+        token_king_moved = (self.white_king_moved, self.black_king_moved)
         self.move_piece(piece, move.xto, move.yto)
 
         # If a pawn reaches the end, upgrade it to a queen.
         if (piece.piece_type == pieces.Pawn.PIECE_TYPE):
             if (piece.y == 0 or piece.y == Board.HEIGHT - 1):
-                self.chesspieces[piece.x][piece.y] = pieces.Queen(piece.x, piece.y, piece.color)
+                queen = pieces.Queen(piece.x, piece.y, piece.color)
+                self.chesspieces[piece.x][piece.y] = queen
+                self.codes[piece.x, piece.y] = Board.get_code(queen)
 
         if (piece.piece_type == pieces.King.PIECE_TYPE):
             # Mark the king as having moved.
@@ -88,42 +143,116 @@ class Board:
             # Check if king-side castling
             if (move.xto - move.xfrom == 2):
                 rook = self.chesspieces[piece.x + 1][piece.y]
-                self.move_piece(rook, piece.x + 1, piece.y)
+                rook_xfrom = rook.x
+                self.move_piece(rook, piece.x - 1, piece.y)
             # Check if queen-side castling
             if (move.xto - move.xfrom == -2):
                 rook = self.chesspieces[piece.x - 2][piece.y]
+                rook_xfrom = rook.x
                 self.move_piece(rook, piece.x + 1, piece.y)
 
+        return (piece, move.xfrom, move.yfrom, taken, token_king_moved, rook, rook_xfrom)
+
+    # Takes back the move that returned the given token. Tokens must be undone in the
+    # reverse order to the moves being performed.
+    def undo_move(self, token):
+        piece, xfrom, yfrom, taken, king_moved, rook, rook_xfrom = token
+        if (rook != 0):
+            self.move_piece(rook, rook_xfrom, rook.y)
+
+        # Putting the taken piece (or 0) back also removes a queen that a pawn was promoted to.
+        self.chesspieces[piece.x][piece.y] = taken
+        self.codes[piece.x, piece.y] = 0 if taken == 0 else Board.get_code(taken)
+        piece.x = xfrom
+        piece.y = yfrom
+        self.chesspieces[xfrom][yfrom] = piece
+        self.codes[xfrom, yfrom] = Board.get_code(piece)
+
+        self.white_king_moved, self.black_king_moved = king_moved
+
     def move_piece(self, piece, xto, yto):
         self.chesspieces[piece.x][piece.y] = 0
+        self.codes[piece.x, piece.y] = 0
         piece.x = xto
         piece.y = yto
 
         self.chesspieces[xto][yto] = piece
+        self.codes[xto, yto] = Board.get_code(piece)
 
-    # Returns if the given color is checked.
+    # Returns if the given color is checked. Looks outwards from the king along the
+    # rays and the knight/pawn offsets instead of trying every opponent move.
     def is_check(self, color):
         other_color = pieces.Piece.WHITE
         if (color == pieces.Piece.WHITE):
             other_color = pieces.Piece.BLACK
 
-        for move in self.get_possible_moves(other_color):
-            copy = Board.clone(self)
-            copy.perform_move(move)
+        king = self.find_king(color)
+        if (king == 0):
+            return True  # The king has been taken, which only happens when searching past a check.
 
-            king_found = False
-            for x in range(Board.WIDTH):
-                for y in range(Board.HEIGHT):
-                    piece = copy.chesspieces[x][y]
-                    if (piece != 0):
-                        if (piece.color == color and piece.piece_type == pieces.King.PIECE_TYPE):
-                            king_found = True
+        return self.is_attacked(king.x, king.y, other_color)
+
+    # Returns the king of the given color or 0 if it is not on the board.
+    def find_king(self, color):
+        for x in range(Board.WIDTH):
+            for y in range(Board.HEIGHT):
+                piece = self.chesspieces[x][y]
+                if (piece != 0 and piece.color == color and piece.piece_type == pieces.King.PIECE_TYPE):
+                    return piece
+        return 0
+
+    # Returns if the square (x, y) is attacked by any piece of the given color.
+    def is_attacked(self, x, y, by_color):
+        for (dx, dy) in Board.KNIGHT_OFFSETS:
+            piece = self.get_piece(x + dx, y + dy)
+            if (piece != 0 and piece.color == by_color and piece.piece_type == pieces.Knight.PIECE_TYPE):
+                return True
 
-            if (not king_found):
+        # Pawns attack diagonally forward, so a white pawn attacks from the row below (higher y).
+        pawn_y = y + 1
+        if (by_color == pieces.Piece.BLACK):
+            pawn_y = y - 1
+        for dx in (-1, 1):
+            piece = self.get_piece(x + dx, pawn_y)
+            if (piece != 0 and piece.color == by_color and piece.piece_type == pieces.Pawn.PIECE_TYPE):
                 return True
 
+        for (dx, dy) in Board.KING_OFFSETS:
+            piece = self.get_piece(x + dx, y + dy)
+            if (piece != 0 and piece.color == by_color and piece.piece_type == pieces.King.PIECE_TYPE):
+                return True
+
+        # The first piece along each ray is the only one that can attack along it.
+        for (dx, dy) in Board.KING_OFFSETS:
+            diagonal = dx != 0 and dy != 0
+            xray = x + dx
+            yray = y + dy
+            while (self.in_bounds(xray, yray)):
+                piece = self.chesspieces[xray][yray]
+                if (piece != 0):
+                    if (piece.color == by_color):
+                        if (piece.piece_type == pieces.Queen.PIECE_TYPE):
+                            return True
+                        if (diagonal and piece.piece_type == pieces.Bishop.PIECE_TYPE):
+                            return True
+                        if (not diagonal and piece.piece_type == pieces.Rook.PIECE_TYPE):
+                            return True
+                    break
+                xray += dx
+                yray += dy
+
         return False
 
+    # Returns the possible moves for the given color that don't leave its king in check.
+    def get_legal_moves(self, color):
+        moves = []
+        for move in self.get_possible_moves(color):
+            token = self.perform_move(move)
+            if (not self.is_check(color)):
+                moves.append(move)
+            self.undo_move(token)
+        return moves
+
     # Returns piece at given position or 0 if: No piece or out of bounds.
     def get_piece(self, x, y):
         if (not self.in_bounds(x, y)):
@@ -0,0 +1,42 @@
+"""
+Measures how long a new Python process takes to start and import the engine,
+compared to a process that imports nothing. Headless workers pay this every
+time they start, so the engine must not import pygame or do any work on import.
+
+Usage: python import_benchmark.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+engineModules = ['ChessEngine', 'ChessAI']
+
+
+def time_process(code, runs):
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.stdout:
+            raise RuntimeError('importing printed output, so it is doing work at import time:\n' + result.stdout)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    # Fails if pygame gets loaded, time_process fails if anything is printed
+    check = ('import sys; import ' + ', '.join(engineModules) + '\n'
+             'assert "pygame" not in sys.modules, "the engine imported pygame"')
+    empty = time_process('pass', runs)
+    engine = time_process(check, runs)
+    print('python startup:          {:8.1f} ms'.format(empty))
+    print('startup + engine import: {:8.1f} ms'.format(engine))
+    print('engine import cost:      {:8.1f} ms (median of {} runs)'.format(engine - empty, runs))
+
+
+if __name__ == '__main__':
+    main()
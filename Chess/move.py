@@ -10,5 +10,9 @@ class Move:
     def equals(self, other_move):
         return self.xfrom == other_move.xfrom and self.yfrom == other_move.yfrom and self.xto == other_move.xto and self.yto == other_move.yto
 
+    # Returns the squares of the move as a tuple, so moves can be put in sets and dicts.
+    def key(self):
+        return (self.xfrom, self.yfrom, self.xto, self.yto)
+
     def to_string(self):
         return "(" + str(self.xfrom) + ", " + str(self.yfrom) + ") -> (" + str(self.xto) + ", " + str(self.yto) + ")"
\ No newline at end of file